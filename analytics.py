@@ -0,0 +1,456 @@
+import ast
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from shared_cache import DEFAULT_SHARED_DIR
+
+# Logged comparisons are stored as immutable Arrow IPC segment files, which
+# are memory-mapped when read. One row per reply shown in a round.
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", os.path.join(DEFAULT_SHARED_DIR, "analytics"))
+SEGMENT_SUFFIX = ".arrow"
+
+SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("comparison_id", pa.string()),
+    ("category", pa.string()),
+    ("model", pa.string()),
+    ("variant", pa.string()),
+    ("won", pa.bool_()),
+    ("latency", pa.float64()),
+])
+
+# Log-spaced latency buckets from 10 ms to 10 min (~5% apart): percentiles
+# are read from bucket counts, which can be updated incrementally
+LATENCY_BUCKETS = np.logspace(-2, np.log10(600), 200)
+# z for the 95% Wilson interval
+Z_95 = 1.959964
+# Every pick writes one small segment; refresh() compacts once there are more
+COMPACT_AFTER_SEGMENTS = int(os.getenv("ANALYTICS_COMPACT_AFTER", "64"))
+# Size-tiered compaction: segments are grouped by the power of this factor
+# their row count falls in, and a tier is merged once it holds this many
+# segments. Merged segments land in a higher tier, so every row is rewritten
+# about log(total rows) times instead of at every compaction.
+COMPACT_TIER_FACTOR = 10
+# Segments at least this large are never merged again
+COMPACT_MAX_ROWS = 5_000_000
+# Only one process compacts at a time; a lock older than this is left over
+# from a crashed process
+COMPACT_LOCK_NAME = ".compact.lock"
+COMPACT_LOCK_STALE_SECONDS = 600
+# Schema metadata key of compacted segments: the segments they replace and
+# their row counts, in the order their rows were written
+COMPACTED_FROM = b"compacted_from"
+
+
+def _write_segment(table: pa.Table, directory: str = ANALYTICS_DIR) -> str:
+    """
+    Write a table as a new segment file. The file is written under a
+    temporary name and renamed, so readers never see a partial segment.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+    path = os.path.join(directory, name)
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def list_segments(directory: str = ANALYTICS_DIR) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def _open_segment(name: str, directory: str):
+    return pa.ipc.open_file(pa.memory_map(os.path.join(directory, name)))
+
+
+def read_segments(names: List[str], directory: str = ANALYTICS_DIR) -> pa.Table:
+    """
+    Memory-map the given segments and return them as one table.
+    """
+    tables = [_open_segment(name, directory).read_all().replace_schema_metadata(None) for name in names]
+    if not tables:
+        return SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def _segment_rows(name: str, directory: str) -> int:
+    # Only reads the batch headers of the memory-mapped file
+    reader = _open_segment(name, directory)
+    return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+def segment_sources(name: str, directory: str = ANALYTICS_DIR) -> List[Tuple[str, int]]:
+    """
+    (name, rows) of the segments a compacted segment replaces, in the order
+    of its rows (empty for other segments).
+    """
+    metadata = _open_segment(name, directory).schema.metadata or {}
+    return [tuple(source) for source in json.loads(metadata[COMPACTED_FROM])] if COMPACTED_FROM in metadata else []
+
+
+def record_comparison(category: str, options: List[Dict], winner_index: int, directory: str = ANALYTICS_DIR):
+    """
+    Log one round: every option shown ({"target", "variant", "latency"}) and
+    which one the user picked.
+    """
+    comparison_id = uuid.uuid4().hex
+    now = pd.Timestamp.now(tz="UTC")
+    table = pa.table({
+        "timestamp": [now] * len(options),
+        "comparison_id": [comparison_id] * len(options),
+        "category": [category] * len(options),
+        "model": [option["target"] for option in options],
+        "variant": [option["variant"] for option in options],
+        "won": [idx == winner_index for idx in range(len(options))],
+        "latency": [option.get("latency") for option in options],
+    }, schema=SCHEMA)
+    _write_segment(table, directory)
+
+
+def _is_logged_response(value) -> bool:
+    # prompt_<variant> cells hold the repr of {"response": ..., "description": ...}
+    if not isinstance(value, str) or not value.startswith("{"):
+        return False
+    try:
+        return isinstance(ast.literal_eval(value), dict)
+    except (ValueError, SyntaxError):
+        return False
+
+
+def _upgrade_old_log(logs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a logs.csv with the old header (one served prompt_variant and its
+    llm_response per row) to the chosen_variant / prompt_<variant> columns.
+
+    Old rows have nothing to compare against and become one-reply rounds.
+    langChain.py appends A/B rows without a header, so in a file started with
+    the old header they land in the old columns: prompt_variant holds the
+    chosen variant and prompt_description / llm_response the A and B replies.
+    """
+    appended = logs["prompt_description"].map(_is_logged_response) & logs["llm_response"].map(_is_logged_response)
+    upgraded = logs[["timestamp", "intent_category"]].assign(
+        chosen_variant=logs["prompt_variant"],
+        prompt_A=logs["prompt_description"].where(appended),
+        prompt_B=logs["llm_response"].where(appended),
+    )
+    for variant in logs.loc[~appended, "prompt_variant"].dropna().unique():
+        column = f"prompt_{variant}"
+        if column not in upgraded:
+            upgraded[column] = np.nan
+        served = ~appended & (logs["prompt_variant"] == variant)
+        upgraded[column] = upgraded[column].mask(served, logs["llm_response"])
+    return upgraded
+
+
+def import_langchain_log(csv_path: str, directory: str = ANALYTICS_DIR) -> int:
+    """
+    Convert the comparisons in a langChain.py logs.csv (rows with
+    chosen_variant and prompt_<variant> columns, or the old prompt_variant
+    rows) to a segment. Returns the number of rows written.
+    """
+    logs = pd.read_csv(csv_path)
+    if "chosen_variant" not in logs.columns:
+        if "prompt_variant" not in logs.columns:
+            return 0
+        logs = _upgrade_old_log(logs)
+    logs = logs.dropna(subset=["chosen_variant"])
+    variant_columns = [col for col in logs.columns if col.startswith("prompt_") and col != "prompt_variant"]
+
+    frames = []
+    for col in variant_columns:
+        variant = col[len("prompt_"):]
+        shown = logs[logs[col].notna()]
+        frames.append(pd.DataFrame({
+            "timestamp": pd.to_datetime(shown["timestamp"], utc=True),
+            "comparison_id": shown.index.astype(str),
+            "category": shown["intent_category"].astype(str),
+            "model": "langchain",
+            "variant": variant,
+            "won": shown["chosen_variant"] == variant,
+            "latency": np.nan,
+        }))
+    if not frames:
+        return 0
+    rows = pd.concat(frames, ignore_index=True)
+    _write_segment(pa.Table.from_pandas(rows, schema=SCHEMA, preserve_index=False), directory)
+    return len(rows)
+
+
+def _acquire_compact_lock(directory: str) -> Optional[str]:
+    path = os.path.join(directory, COMPACT_LOCK_NAME)
+    try:
+        if time.time() - os.path.getmtime(path) > COMPACT_LOCK_STALE_SECONDS:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return None
+    return path
+
+
+def compact_segments(directory: str = ANALYTICS_DIR, max_rows: int = COMPACT_MAX_ROWS,
+                     tier_factor: int = COMPACT_TIER_FACTOR, only: Optional[Iterable[str]] = None) -> int:
+    """
+    Merge small segments into larger ones (fewer files to open and map),
+    optionally only among the segments in `only`. Returns the number of
+    segments removed; 0 when another process is compacting.
+
+    A merged segment records the segments it replaces, which are deleted
+    after it is written, so readers never count a row twice.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    lock = _acquire_compact_lock(directory)
+    if lock is None:
+        return 0
+    try:
+        return _compact(directory, max_rows, tier_factor, only)
+    finally:
+        os.remove(lock)
+
+
+def _compact(directory: str, max_rows: int, tier_factor: int, only: Optional[Iterable[str]]) -> int:
+    names = list_segments(directory)
+    if only is not None:
+        only = set(only)
+        names = [name for name in names if name in only]
+    tiers: Dict[int, List[Tuple[str, int]]] = {}
+    for name in names:
+        rows = _segment_rows(name, directory)
+        if rows < max_rows:
+            tiers.setdefault(int(math.log(max(rows, 1), tier_factor)), []).append((name, rows))
+
+    removed = 0
+    for segments in tiers.values():
+        if len(segments) < tier_factor:
+            continue
+        batch, batch_rows = [], 0
+        for name, rows in segments + [(None, 0)]:
+            if name is None or batch_rows + rows > max_rows:
+                if len(batch) > 1:
+                    merged = read_segments([source for source, _ in batch], directory)
+                    _write_segment(merged.replace_schema_metadata({COMPACTED_FROM: json.dumps(batch)}), directory)
+                    for old, _ in batch:
+                        os.remove(os.path.join(directory, old))
+                    removed += len(batch) - 1
+                batch, batch_rows = [], 0
+            if name is not None:
+                batch.append((name, rows))
+                batch_rows += rows
+    return removed
+
+
+def wilson_interval(wins, n, z: float = Z_95):
+    """
+    Vectorized Wilson score interval for win rates; returns (low, high).
+    """
+    wins = np.asarray(wins, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = wins / n
+        denom = 1 + z ** 2 / n
+        center = (p + z ** 2 / (2 * n)) / denom
+        half = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denom
+    return np.nan_to_num(center - half), np.nan_to_num(center + half, nan=1.0)
+
+
+def _bucket_percentiles(hist: pd.DataFrame, quantiles) -> pd.DataFrame:
+    """
+    Percentiles (upper bucket edge) per row of a bucket-count frame.
+    """
+    counts = hist.to_numpy()
+    cumulative = counts.cumsum(axis=1)
+    totals = cumulative[:, -1:]
+    result = {}
+    for q in quantiles:
+        first = (cumulative >= np.maximum(totals * q, 1)).argmax(axis=1)
+        values = LATENCY_BUCKETS[np.minimum(first, len(LATENCY_BUCKETS) - 1)]
+        result[f"p{int(q * 100)}_s"] = np.where(totals[:, 0] > 0, values, np.nan)
+    return pd.DataFrame(result, index=hist.index)
+
+
+def _plain_index(frame: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """
+    Replace a categorical group-by index with a plain string one, so
+    aggregates from different batches (different categories) can be added.
+    """
+    frame = frame.reset_index()
+    frame[columns] = frame[columns].astype(str)
+    return frame.set_index(columns)
+
+
+class ResultsAggregator:
+    """
+    Win counts and latency buckets per (category, variant) and per model,
+    updated incrementally: refresh() only reads segments it has not seen.
+    Of a compacted segment, only the rows of replaced segments not read yet
+    are added; when a segment disappears without such a replacement, it
+    starts over.
+
+    Model rows only count rounds that compared different models (in a
+    single-model round both replies come from the same model).
+    """
+
+    GROUPS = {"variant": ["category", "variant"], "model": ["model"]}
+    # Attempts of refresh() when segments are deleted while it reads them
+    REFRESH_ATTEMPTS = 3
+
+    def __init__(self, directory: str = ANALYTICS_DIR, compact_after: int = COMPACT_AFTER_SEGMENTS,
+                 tier_factor: int = COMPACT_TIER_FACTOR):
+        self.directory = directory
+        self.compact_after = compact_after
+        self.tier_factor = tier_factor
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.seen = set()
+        self.replaced = set()
+        self.rows = 0
+        self.counts = {key: None for key in self.GROUPS}
+        self.latency = {key: None for key in self.GROUPS}
+
+    def refresh(self) -> int:
+        """
+        Read new segments and add them to the aggregates, then compact the
+        directory when it holds too many segments. Returns the number of
+        new rows.
+        """
+        with self._lock:
+            for attempt in range(self.REFRESH_ATTEMPTS):
+                try:
+                    new_rows = self._refresh()
+                    break
+                except FileNotFoundError:
+                    # Compacted by another process between listing and reading
+                    if attempt == self.REFRESH_ATTEMPTS - 1:
+                        raise
+            # Only segments already read are merged, so the merged segment
+            # is skipped by the next refresh instead of read again
+            if len(list_segments(self.directory)) > self.compact_after:
+                compact_segments(self.directory, tier_factor=self.tier_factor, only=self.seen)
+            return new_rows
+
+    def _refresh(self) -> int:
+        names = list_segments(self.directory)
+        new = [name for name in names if name not in self.seen]
+        replaced, compacted = set(), set()
+        # (name, first row, row count) of compacted segments holding unread rows
+        slices = []
+        for name in new:
+            sources = segment_sources(name, self.directory)
+            if sources:
+                compacted.add(name)
+            offset = 0
+            for source, rows in sources:
+                if source not in self.seen:
+                    slices.append((name, offset, rows))
+                offset += rows
+            replaced |= {source for source, _ in sources}
+        # Seen segments may only disappear after being merged into another
+        rebuild = bool(self.seen - set(names) - self.replaced - replaced)
+        if rebuild:
+            new, slices, compacted = names, [], set()
+            replaced = {source for name in names for source, _ in segment_sources(name, self.directory)}
+        # Segments still listed but already merged into a listed one are skipped
+        whole = [name for name in new if name not in replaced and name not in compacted]
+        if not whole and not slices and not rebuild:
+            self.seen.update(new)
+            self.replaced |= replaced
+            return 0
+
+        tables = [read_segments(whole, self.directory)]
+        for name, offset, rows in slices:
+            tables.append(read_segments([name], self.directory).slice(offset, rows))
+        table = pa.concat_tables(tables)
+        # Dictionary-encoded strings become categoricals: cheap group-bys
+        for col in ("category", "model", "variant"):
+            idx = table.schema.get_field_index(col)
+            table = table.set_column(idx, col, table.column(col).dictionary_encode())
+        frame = table.select(["comparison_id", "category", "model", "variant", "won", "latency"]).to_pandas()
+        previous_rows = self.rows
+        if rebuild:
+            self._reset()
+        self._add(frame)
+        self.seen.update(new)
+        self.replaced |= replaced
+        self.rows += len(frame)
+        return max(self.rows - previous_rows, 0)
+
+    def _add(self, frame: pd.DataFrame):
+        frame = frame.assign(wins=frame["won"].astype(np.int64))
+        timed = frame[frame["latency"].notna()]
+        buckets = np.searchsorted(LATENCY_BUCKETS, timed["latency"].to_numpy())
+        timed = timed.assign(bucket=np.minimum(buckets, len(LATENCY_BUCKETS) - 1))
+
+        models_per_round = frame.groupby("comparison_id")["model"].transform("nunique")
+        for key, columns in self.GROUPS.items():
+            rows = frame[models_per_round > 1] if key == "model" else frame
+            counts = _plain_index(
+                rows.groupby(columns, observed=True).agg(n=("won", "size"), wins=("wins", "sum")), columns
+            )
+            self.counts[key] = counts if self.counts[key] is None else self.counts[key].add(counts, fill_value=0)
+
+            if key == "model":
+                timed = timed[models_per_round.loc[timed.index] > 1]
+            hist = timed.groupby(columns + ["bucket"], observed=True).size().unstack("bucket", fill_value=0)
+            hist = _plain_index(hist.reindex(columns=range(len(LATENCY_BUCKETS)), fill_value=0), columns)
+            self.latency[key] = hist if self.latency[key] is None else self.latency[key].add(hist, fill_value=0)
+
+    def summary(self, key: str = "variant", category: Optional[str] = None) -> pd.DataFrame:
+        """
+        Win rate with 95% interval and latency p50/p95/p99 per group
+        ("variant": category and variant, "model": model).
+        """
+        with self._lock:
+            counts, hist = self.counts[key], self.latency[key]
+        columns = self.GROUPS[key]
+        if counts is None:
+            return pd.DataFrame(columns=columns + ["n", "wins", "win_rate", "ci_low", "ci_high"])
+
+        result = counts.astype(np.int64)
+        result["win_rate"] = result["wins"] / result["n"]
+        result["ci_low"], result["ci_high"] = wilson_interval(result["wins"], result["n"])
+        if hist is not None and len(hist):
+            result = result.join(_bucket_percentiles(hist, (0.5, 0.95, 0.99)))
+        result = result.reset_index()
+        if category is not None and "category" in result:
+            result = result[result["category"] == category]
+        return result.sort_values("win_rate", ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain the A/B results store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_parser = sub.add_parser("import-csv", help="Import comparisons from a langChain.py logs.csv")
+    import_parser.add_argument("path")
+    sub.add_parser("compact", help="Merge small segment files")
+    sub.add_parser("summary", help="Print win rates per category and variant")
+    args = parser.parse_args()
+
+    if args.command == "import-csv":
+        print(f"Imported {import_langchain_log(args.path)} rows")
+    elif args.command == "compact":
+        print(f"Removed {compact_segments()} segments")
+    else:
+        aggregator = ResultsAggregator()
+        aggregator.refresh()
+        print(aggregator.summary().to_string())
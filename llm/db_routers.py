@@ -0,0 +1,33 @@
+from django.conf import settings
+
+
+def replica_database() -> str:
+    """
+    Alias to use for reads that may lag behind writes: "replica" when one is
+    configured, "default" otherwise. Used by the read-heavy list and detail
+    endpoints (see nopreserveroot.views.ReplicaReadMixin).
+    """
+    return "replica" if "replica" in settings.DATABASES else "default"
+
+
+class ReplicaRouter:
+    """
+    Keep all writes and migrations on "default". Reads also use "default"
+    unless a view explicitly reads from replica_database(), so lookups
+    that must see the latest writes (get_object() before an update, related
+    field validation) are never sent to a lagging replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated through replication, not by manage.py migrate
+        return db == "default"
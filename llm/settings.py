@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,6 +40,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
+    'nopreserveroot',
 ]
 
 MIDDLEWARE = [
@@ -72,12 +77,61 @@ WSGI_APPLICATION = "llm.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment:
+#   DB_ENGINE          "sqlite" (default) or "mysql"
+#   DB_NAME            database name, or file path for sqlite
+#   DB_USER, DB_PASSWORD, DB_HOST, DB_PORT   mysql connection
+#   DB_REPLICA_HOST    mysql read replica (for sqlite: DB_REPLICA_NAME)
+#   DB_CONN_MAX_AGE    seconds a connection is kept open between requests
+
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite")
+if DB_ENGINE not in ("sqlite", "mysql"):
+    # Don't fall back to a local sqlite file on a typo
+    raise ImproperlyConfigured(f'DB_ENGINE must be "sqlite" or "mysql", not "{DB_ENGINE}".')
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+
+if DB_ENGINE == "mysql":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': os.getenv("DB_NAME") or "llm",
+            'USER': os.getenv("DB_USER", "llm"),
+            'PASSWORD': os.getenv("DB_PASSWORD", ""),
+            'HOST': os.getenv("DB_HOST", "localhost"),
+            'PORT': os.getenv("DB_PORT", "3306"),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            },
+        }
+    }
+    if os.getenv("DB_REPLICA_HOST"):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.getenv("DB_REPLICA_HOST"),
+            'PORT': os.getenv("DB_REPLICA_PORT", DATABASES['default']['PORT']),
+            'USER': os.getenv("DB_REPLICA_USER", DATABASES['default']['USER']),
+            'PASSWORD': os.getenv("DB_REPLICA_PASSWORD", DATABASES['default']['PASSWORD']),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv("DB_NAME") or BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
+    if os.getenv("DB_REPLICA_NAME"):
+        DATABASES['replica'] = {**DATABASES['default'], 'NAME': os.getenv("DB_REPLICA_NAME")}
+
+if 'replica' in DATABASES:
+    # Tests read through the replica alias from the default test database
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['llm.db_routers.ReplicaRouter']
 
 
 # Password validation
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from contextvars import copy_context
+from typing import Dict, List, Optional, Tuple
+
+from profiling import span
+
+# Provider -> API key env variable and the models offered for it
+PROVIDERS = {
+    "Google Gemini": {"env": "GOOGLE_API_KEY", "models": ["gemini-1.5-flash", "gemini-1.5-pro"]},
+    "OpenAI": {"env": "OPENAI_API_KEY", "models": ["gpt-3.5-turbo", "gpt-4o-mini"]},
+}
+DEFAULT_MODELS = {"Google Gemini": "gemini-1.5-flash", "OpenAI": "gpt-3.5-turbo"}
+
+# Number of recent latencies kept per target for the p95
+LATENCY_WINDOW = 200
+# Below this many samples there is no p95 yet, so hedging uses this timeout
+DEFAULT_HEDGE_AFTER_SECONDS = 10.0
+MIN_HEDGE_SAMPLES = 5
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm")
+
+
+def configured_targets() -> List[str]:
+    """
+    Return the "provider / model" labels of every model whose API key is set.
+    """
+    targets = []
+    for provider, info in PROVIDERS.items():
+        if os.getenv(info["env"]):
+            targets.extend(f"{provider} / {model}" for model in info["models"])
+    return targets
+
+
+def split_target(target: str) -> Tuple[str, str]:
+    """
+    "OpenAI / gpt-3.5-turbo" -> ("OpenAI", "gpt-3.5-turbo")
+    """
+    provider, model = target.split(" / ", 1)
+    return provider, model
+
+
+def create_llm(provider: str, model: Optional[str] = None, temperature: float = 0.7):
+    """
+    Build the LangChain chat model for a provider. Raises ValueError when the
+    provider's API key is not set.
+    """
+    model = model or DEFAULT_MODELS[provider]
+    api_key = os.getenv(PROVIDERS[provider]["env"])
+    if not api_key:
+        raise ValueError(f"No {PROVIDERS[provider]['env']} found. Add it to your .env file.")
+
+    if provider == "Google Gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(google_api_key=api_key, model=model, temperature=temperature)
+
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(api_key=api_key, model=model, temperature=temperature)
+
+
+def invoke_llm(llm, messages) -> Tuple[str, float]:
+    """
+    Send the messages to the model and return (reply text, latency in seconds).
+    """
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    with span("provider_io", model=str(model)):
+        start = time.perf_counter()
+        reply = llm.invoke(messages)
+        return reply.content, time.perf_counter() - start
+
+
+def _submit(fn, *args):
+    # Run in the pool with the caller's context, so spans join the caller's trace
+    return _executor.submit(copy_context().run, fn, *args)
+
+
+class LatencyTracker:
+    """
+    Keeps recent latencies, rounds and wins per target (a provider / model
+    label) for the p95 used by hedging and the win rate shown in the sidebar.
+
+    Latencies are recorded from pool threads, so all state is guarded by a
+    lock. With a `store` (shared_cache.SharedCache) every update is also
+    written there, and reload() picks up what other processes recorded.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW, store=None):
+        self.window = window
+        self.store = store
+        self.latencies: Dict[str, deque] = {}
+        self.rounds: Dict[str, int] = {}
+        self.wins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        if self.store is None:
+            return
+        latencies = self.store.recent_latencies(self.window)
+        rounds = self.store.model_rounds()
+        with self._lock:
+            self.latencies = {target: deque(values, maxlen=self.window) for target, values in latencies.items()}
+            self.rounds = {target: counts["rounds"] for target, counts in rounds.items()}
+            self.wins = {target: counts["wins"] for target, counts in rounds.items()}
+
+    def record_latency(self, target: str, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(target, deque(maxlen=self.window)).append(seconds)
+        if self.store is not None:
+            self.store.record_latency(target, seconds, self.window)
+
+    def record_round(self, targets: List[str], winner: Optional[str]):
+        with self._lock:
+            for target in set(targets):
+                self.rounds[target] = self.rounds.get(target, 0) + 1
+            if winner is not None:
+                self.wins[winner] = self.wins.get(winner, 0) + 1
+        if self.store is not None:
+            self.store.record_round(targets, winner)
+
+    def has_rounds(self) -> bool:
+        with self._lock:
+            return bool(self.rounds)
+
+    def _samples(self, target: str) -> List[float]:
+        with self._lock:
+            return sorted(self.latencies.get(target, ()))
+
+    @staticmethod
+    def _p95(samples: List[float]) -> Optional[float]:
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+    def p95(self, target: str) -> Optional[float]:
+        return self._p95(self._samples(target))
+
+    def summary(self) -> List[Dict]:
+        """
+        One row per target: rounds, wins, win rate, median and p95 latency.
+        """
+        with self._lock:
+            latencies = {target: sorted(values) for target, values in self.latencies.items()}
+            rounds, wins = dict(self.rounds), dict(self.wins)
+        rows = []
+        for target in sorted(set(latencies) | set(rounds)):
+            samples = latencies.get(target, [])
+            target_rounds = rounds.get(target, 0)
+            target_wins = wins.get(target, 0)
+            rows.append({
+                "target": target,
+                "rounds": target_rounds,
+                "wins": target_wins,
+                "win_rate": target_wins / target_rounds if target_rounds else 0.0,
+                "p50_s": samples[len(samples) // 2] if samples else None,
+                "p95_s": self._p95(samples),
+            })
+        return rows
+
+
+def hedged_invoke(llms: Dict[str, object], primary: str, backup: Optional[str], messages,
+                  tracker: LatencyTracker) -> Tuple[str, str, float]:
+    """
+    Send the messages to `primary`; if it has not answered after its p95
+    latency, also send them to `backup` and take whichever answers first.
+
+    Returns (target that answered, reply text, latency seen by the user).
+    """
+    def submit(target):
+        future = _submit(invoke_llm, llms[target], messages)
+        # Record every latency, also of the request that lost the race,
+        # so the p95 is not biased towards fast replies
+        future.add_done_callback(
+            lambda f: f.exception() is None and tracker.record_latency(target, f.result()[1])
+        )
+        return future
+
+    start = time.perf_counter()
+    futures = {submit(primary): primary}
+    if backup is not None:
+        hedge_after = tracker.p95(primary) or DEFAULT_HEDGE_AFTER_SECONDS
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done or next(iter(done)).exception() is not None:
+            futures[submit(backup)] = backup
+
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            target = futures[future]
+            try:
+                text, _ = future.result()
+            except Exception as e:
+                error = e
+                continue
+            # The slower request keeps running; its result is dropped
+            return target, text, time.perf_counter() - start
+    raise error
+
+
+def fan_out(llms: Dict[str, object], jobs: List[Tuple[str, object]], tracker: LatencyTracker):
+    """
+    Send each (target, messages) job at the same time and yield
+    (job index, reply text, latency, error) in the order they finish.
+    """
+    futures = {
+        _submit(invoke_llm, llms[target], messages): idx
+        for idx, (target, messages) in enumerate(jobs)
+    }
+    for future in as_completed(futures):
+        idx = futures[future]
+        try:
+            text, latency = future.result()
+        except Exception as e:
+            yield idx, "", None, e
+            continue
+        tracker.record_latency(jobs[idx][0], latency)
+        yield idx, text, latency, None
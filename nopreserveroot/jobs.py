@@ -0,0 +1,183 @@
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.utils import timezone
+
+from nopreserveroot.models import EvaluationJob, EvaluationResult
+
+PROMPTS_YAML_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts.yaml")
+# A running job whose worker has not sent a heartbeat for this long is requeued
+STALE_AFTER = timedelta(minutes=int(os.getenv("EVAL_JOB_STALE_MINUTES", "10")))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Put running jobs back in the queue when their worker stopped sending
+    heartbeats (crashed or restarted). Results already written are kept.
+    """
+    return EvaluationJob.objects.filter(
+        status=EvaluationJob.Status.RUNNING, heartbeat_at__lt=timezone.now() - STALE_AFTER
+    ).update(status=EvaluationJob.Status.QUEUED, worker="")
+
+
+def claim_next_job(worker_id: str):
+    """
+    Claim the oldest queued job for this worker, or return None.
+
+    The claim is a conditional UPDATE, so when several workers (on one host
+    or several) race for the same job only one of them gets it. Works the
+    same on SQLite and MySQL.
+    """
+    candidates = EvaluationJob.objects.filter(status=EvaluationJob.Status.QUEUED).values_list("id", flat=True)
+    for job_id in candidates[:10]:
+        now = timezone.now()
+        claimed = EvaluationJob.objects.filter(id=job_id, status=EvaluationJob.Status.QUEUED).update(
+            status=EvaluationJob.Status.RUNNING, worker=worker_id, started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            return EvaluationJob.objects.get(id=job_id)
+    return None
+
+
+def _heartbeat(job, worker_id: str) -> bool:
+    """
+    Save progress and report whether this worker still owns the job
+    (False once it was cancelled or requeued).
+    """
+    return bool(EvaluationJob.objects.filter(
+        id=job.id, status=EvaluationJob.Status.RUNNING, worker=worker_id
+    ).update(completed=job.completed, heartbeat_at=timezone.now()))
+
+
+def _system_prompt_generator(job):
+    """
+    Return generate(question) -> [(variant, run)] using the system prompt
+    variants of prompt_utils, as the Streamlit app does; run() returns
+    (response, latency).
+    """
+    from model_utils import create_llm, invoke_llm, split_target
+    from prompt_utils import build_chat_messages
+
+    provider, model = split_target(job.model)
+    llm = create_llm(provider, model)
+
+    def generate(question):
+        return [
+            (variant, lambda messages=messages: invoke_llm(llm, messages))
+            for messages, variant in build_chat_messages(job.category, question)
+        ]
+
+    return generate
+
+
+def _prompts_yaml_generator(job):
+    """
+    Return generate(question) -> [(variant, run)] using the prompts.yaml
+    templates and LangChain chains of langChain.py; run() returns
+    (response, latency).
+    """
+    from nopreserveroot.langChain import create_chains_by_category, load_prompts_by_category
+
+    prompts = load_prompts_by_category(PROMPTS_YAML_PATH)
+    if job.category not in prompts:
+        raise ValueError(f"Unknown category in prompts.yaml: {job.category}")
+    chains = create_chains_by_category({job.category: prompts[job.category]})[job.category]
+
+    def run_chain(chain, question):
+        start = time.perf_counter()
+        response = chain.run({"user_input": question})
+        return response, time.perf_counter() - start
+
+    def generate(question):
+        return [
+            (variant, lambda chain=chain_info["chain"]: run_chain(chain, question))
+            for variant, chain_info in chains.items()
+        ]
+
+    return generate
+
+
+GENERATORS = {
+    EvaluationJob.Source.SYSTEM_PROMPTS: _system_prompt_generator,
+    EvaluationJob.Source.PROMPTS_YAML: _prompts_yaml_generator,
+}
+
+
+def run_job(job, worker_id: str):
+    """
+    Run every question of the job against every variant and write one
+    EvaluationResult per question and variant.
+
+    A variant that fails gets a result with the error; the job fails when
+    every result has one. Questions that already have results (from a
+    previous, interrupted run) are skipped. Stops early when the job is
+    cancelled.
+    """
+    try:
+        generate = GENERATORS[job.source](job)
+    except Exception as e:
+        _finish(job, worker_id, EvaluationJob.Status.FAILED, error=str(e))
+        return
+
+    done_questions = set(job.results.values_list("question_index", flat=True))
+    job.completed = len(done_questions)
+
+    for index, question in enumerate(job.questions):
+        if index in done_questions:
+            continue
+        if not _heartbeat(job, worker_id):
+            # Cancelled: keep the progress made since the last heartbeat
+            EvaluationJob.objects.filter(
+                id=job.id, status=EvaluationJob.Status.CANCELLED, worker=worker_id
+            ).update(completed=job.completed)
+            return
+
+        rows = []
+        try:
+            variants = generate(question)
+        except Exception as e:
+            variants = []
+            rows.append(EvaluationResult(job=job, question_index=index, question=question, variant="", error=str(e)))
+        for variant, run in variants:
+            row = EvaluationResult(job=job, question_index=index, question=question, variant=variant)
+            try:
+                row.response, row.latency = run()
+            except Exception as e:
+                row.error = str(e)
+            rows.append(row)
+
+        try:
+            EvaluationResult.objects.bulk_create(rows)
+        except IntegrityError:
+            # Another worker wrote this question after the job was requeued
+            pass
+        job.completed += 1
+
+    if not job.results.filter(error="").exists():
+        last_error = job.results.order_by("-id").values_list("error", flat=True).first() or ""
+        _finish(job, worker_id, EvaluationJob.Status.FAILED, error=f"Every reply failed: {last_error}")
+        return
+    _finish(job, worker_id, EvaluationJob.Status.DONE)
+
+
+def _finish(job, worker_id: str, status, error: str = ""):
+    EvaluationJob.objects.filter(
+        id=job.id, status=EvaluationJob.Status.RUNNING, worker=worker_id
+    ).update(status=status, completed=job.completed, error=error, finished_at=timezone.now())
+
+
+def cancel_job(job) -> bool:
+    """
+    Cancel a queued or running job. A running job stops after the question
+    it is working on.
+    """
+    return bool(EvaluationJob.objects.filter(
+        id=job.id, status__in=[EvaluationJob.Status.QUEUED, EvaluationJob.Status.RUNNING]
+    ).update(status=EvaluationJob.Status.CANCELLED, finished_at=timezone.now()))
@@ -4,8 +4,20 @@ import json
 import datetime
 import pandas as pd
 import os
+from contextlib import nullcontext
 from dotenv import load_dotenv
 
+try:
+    from profiling import profile_request, span
+except ImportError:
+    # Run as a script from this directory (profiling.py is at the repository
+    # root): no profiling
+    def profile_request(name, directory=None):
+        return nullcontext()
+
+    def span(name, **args):
+        return nullcontext()
+
 # Load from .env file if available
 load_dotenv()
 
@@ -14,19 +26,10 @@ from langchain.chains import LLMChain
 from langchain_core.prompts import PromptTemplate
 from langchain_community.llms import OpenAI
 
-# Debug: show working dir
-print("Current working directory:", os.getcwd())
-
-# Check the API key
-if "OPENAI_API_KEY" not in os.environ:
-    print("OPENAI_API_KEY is not set! Set it in .env or environment.")
-    exit(1)
-
 # Load prompts from YAML
 def load_prompts_by_category(filepath="prompts.yaml"):
     if not os.path.isfile(filepath):
-        print(f" File not found: {filepath}")
-        exit(1)
+        raise FileNotFoundError(f"File not found: {filepath}")
     with open(filepath, "r") as f:
         data = yaml.safe_load(f)
     return data["prompts_by_category"]
@@ -75,14 +78,22 @@ def classify_intent(user_input: str) -> str:
 
 # Handle user request
 def handle_user_request(user_id: int, user_input: str, chains_by_category):
+    # Opt-in profiling (PROFILE_TRACE_DIR): one trace per request
+    with profile_request("handle_user_request"):
+        return _handle_user_request(user_id, user_input, chains_by_category)
+
+
+def _handle_user_request(user_id: int, user_input: str, chains_by_category):
     # Classify intent
-    intent_category = classify_intent(user_input)
+    with span("classify_intent"):
+        intent_category = classify_intent(user_input)
     category_chains = chains_by_category.get(intent_category)
 
     # Generate responses for all prompt variants (A/B)
     variant_responses = {}
     for prompt_key, chain_info in category_chains.items():
-        response = chain_info["chain"].run({"user_input": user_input})
+        with span("generate_variant", variant=prompt_key):
+            response = chain_info["chain"].run({"user_input": user_input})
         variant_responses[prompt_key] = {
             "response": response,
             "description": chain_info["description"]
@@ -98,8 +109,9 @@ def handle_user_request(user_id: int, user_input: str, chains_by_category):
         f"Choose the best response (A or B) and respond with only the letter (no explanation)."
     )
 
-    evaluator_llm = OpenAI(temperature=0)
-    best_option = evaluator_llm.invoke(comparison_prompt).strip().upper()
+    with span("evaluate"):
+        evaluator_llm = OpenAI(temperature=0)
+        best_option = evaluator_llm.invoke(comparison_prompt).strip().upper()
 
     # Validate best option (fallback to A)
     if best_option not in {"A", "B"}:
@@ -117,8 +129,9 @@ def handle_user_request(user_id: int, user_input: str, chains_by_category):
         "prompt_B": variant_responses['B']
     }
 
-    log_df = pd.DataFrame([log_entry])
-    log_df.to_csv("logs.csv", mode="a", header=not os.path.isfile("logs.csv"), index=False)
+    with span("write_log"):
+        log_df = pd.DataFrame([log_entry])
+        log_df.to_csv("logs.csv", mode="a", header=not os.path.isfile("logs.csv"), index=False)
 
     # Return best response
     best_response = variant_responses[best_option]["response"]
@@ -156,7 +169,19 @@ def add_new_prompt_to_category(filepath="prompts.yaml"):
 
 # usage
 if __name__ == "__main__":
-    prompts_by_category = load_prompts_by_category()
+    # Debug: show working dir
+    print("Current working directory:", os.getcwd())
+
+    # Check the API key
+    if "OPENAI_API_KEY" not in os.environ:
+        print("OPENAI_API_KEY is not set! Set it in .env or environment.")
+        exit(1)
+
+    try:
+        prompts_by_category = load_prompts_by_category()
+    except FileNotFoundError as e:
+        print(f" {e}")
+        exit(1)
     chains_by_category = create_chains_by_category(prompts_by_category)
 
     print("\nWhat would you like to do?")
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from nopreserveroot.jobs import claim_next_job, default_worker_id, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued evaluation jobs. Start as many workers as needed, on one "
+        "host or several: they coordinate through the database only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--worker-id", default=None, help="Name of this worker (default: host:pid)")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        worker_id = options["worker_id"] or default_worker_id()
+        self.stdout.write(f"Worker {worker_id} started")
+
+        while True:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+            job = claim_next_job(worker_id)
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"Running job {job.id}: {job}")
+            run_job(job, worker_id)
+            job.refresh_from_db()
+            self.stdout.write(f"Job {job.id} {job.status} ({job.completed}/{job.total})")
@@ -1,3 +1,96 @@
+from django.contrib.auth.base_user import AbstractBaseUser
 from django.db import models
 
-# Create your models here.
+
+class User(AbstractBaseUser):
+    username = models.CharField(max_length=255, unique=True)
+    email = models.EmailField(unique=True)
+    password = models.CharField(max_length=75)
+    role = models.CharField(max_length=50, default="user")
+    is_active = models.BooleanField(default=False)
+    is_admin = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    USERNAME_FIELD = "username"
+    EMAIL_FIELD = "email"
+    REQUIRED_FIELDS = ["email"]
+
+    def __str__(self):
+        return self.username
+
+
+class Category(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    description = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Prompt(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    description = models.CharField(max_length=255)
+    score = models.IntegerField(default=0)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class EvaluationJob(models.Model):
+    class Source(models.TextChoices):
+        # System prompt variants from prompt_utils.get_system_prompts
+        SYSTEM_PROMPTS = "system_prompts"
+        # Prompt templates from prompts.yaml, run through langChain.py
+        PROMPTS_YAML = "prompts_yaml"
+
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+        CANCELLED = "cancelled"
+
+    source = models.CharField(max_length=20, choices=Source.choices, default=Source.SYSTEM_PROMPTS)
+    category = models.CharField(max_length=255)
+    model = models.CharField(max_length=255, default="OpenAI / gpt-3.5-turbo")
+    questions = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED, db_index=True)
+    total = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+
+    def __str__(self):
+        return f"{self.category} ({self.status}, {self.completed}/{self.total})"
+
+
+class EvaluationResult(models.Model):
+    job = models.ForeignKey(EvaluationJob, on_delete=models.CASCADE, related_name="results")
+    question_index = models.IntegerField()
+    question = models.TextField()
+    variant = models.CharField(max_length=50)
+    response = models.TextField(blank=True)
+    latency = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ["job", "question_index", "variant"]
+        ordering = ["question_index", "variant"]
+
+    def __str__(self):
+        return f"{self.job_id} #{self.question_index} {self.variant}"
@@ -1,6 +1,8 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, ValidationError
 
-from nopreserveroot.models import Category, Prompt
+from model_utils import PROVIDERS
+
+from nopreserveroot.models import Category, EvaluationJob, EvaluationResult, Prompt
 
 
 class CategorySerializer(ModelSerializer):
@@ -13,3 +15,41 @@ class PromptSerializer(ModelSerializer):
     class Meta:
         model = Prompt
         exclude = ["updated_at"]
+
+
+class EvaluationResultSerializer(ModelSerializer):
+    class Meta:
+        model = EvaluationResult
+        exclude = ["job"]
+
+
+class EvaluationJobSerializer(ModelSerializer):
+    class Meta:
+        model = EvaluationJob
+        fields = [
+            "id", "source", "category", "model", "questions", "status", "total", "completed",
+            "worker", "error", "started_at", "finished_at", "created_at",
+        ]
+        read_only_fields = ["status", "total", "completed", "worker", "error", "started_at", "finished_at"]
+
+    def validate_questions(self, value):
+        if not isinstance(value, list) or not value or not all(isinstance(q, str) for q in value):
+            raise ValidationError("questions must be a non-empty list of strings")
+        return value
+
+    def validate_model(self, value):
+        provider, _, model = value.partition(" / ")
+        if model not in PROVIDERS.get(provider, {}).get("models", []):
+            choices = [f"{p} / {m}" for p, info in PROVIDERS.items() for m in info["models"]]
+            raise ValidationError(f"model must be one of: {', '.join(choices)}")
+        return value
+
+    def validate(self, attrs):
+        # The prompts.yaml chains of langChain.py always use its OpenAI LLM
+        if attrs.get("source") == EvaluationJob.Source.PROMPTS_YAML and "model" in attrs:
+            raise ValidationError({"model": "model can't be chosen with source prompts_yaml."})
+        return attrs
+
+    def create(self, validated_data):
+        validated_data["total"] = len(validated_data["questions"])
+        return super().create(validated_data)
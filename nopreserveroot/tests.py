@@ -1,3 +1,258 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from llm.db_routers import ReplicaRouter, replica_database
+from nopreserveroot.jobs import (
+    GENERATORS, STALE_AFTER, _finish, _heartbeat, cancel_job, claim_next_job, requeue_stale_jobs, run_job
+)
+from nopreserveroot.models import Category, EvaluationJob, EvaluationResult, Prompt
+from nopreserveroot.views import CategoryViewSet, PromptViewSet
+from shared_cache import SharedCache
+
+REPLICA = {"ENGINE": "django.db.backends.sqlite3", "NAME": "replica.sqlite3"}
+
+
+def with_replica():
+    return mock.patch.dict(settings.DATABASES, {"replica": REPLICA})
+
+
+def without_replica():
+    patcher = mock.patch.dict(settings.DATABASES)
+    patcher.start()
+    settings.DATABASES.pop("replica", None)
+    return patcher
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    router = ReplicaRouter()
+
+    def test_reads_and_writes_use_default(self):
+        with with_replica():
+            for model in (Category, Prompt):
+                self.assertIsNone(self.router.db_for_read(model))
+                self.assertEqual(self.router.db_for_write(model), "default")
+
+    def test_only_default_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate("default", "nopreserveroot"))
+        self.assertFalse(self.router.allow_migrate("replica", "nopreserveroot"))
+
+    def test_replica_database(self):
+        with with_replica():
+            self.assertEqual(replica_database(), "replica")
+        patcher = without_replica()
+        try:
+            self.assertEqual(replica_database(), "default")
+        finally:
+            patcher.stop()
+
+
+class ReplicaReadViewTests(SimpleTestCase):
+    factory = APIRequestFactory()
+
+    def queryset_db(self, viewset, action, method):
+        view = viewset()
+        view.action = action
+        view.request = getattr(self.factory, method)("/")
+        return view.get_queryset().db
+
+    def test_list_and_retrieve_read_from_replica(self):
+        with with_replica():
+            for viewset in (CategoryViewSet, PromptViewSet):
+                self.assertEqual(self.queryset_db(viewset, "list", "get"), "replica")
+                self.assertEqual(self.queryset_db(viewset, "retrieve", "get"), "replica")
+
+    def test_writes_look_up_objects_on_default(self):
+        with with_replica():
+            for action, method in (("update", "put"), ("partial_update", "patch"), ("destroy", "delete")):
+                self.assertEqual(self.queryset_db(PromptViewSet, action, method), "default")
+
+    def test_without_replica_everything_uses_default(self):
+        patcher = without_replica()
+        try:
+            self.assertEqual(self.queryset_db(CategoryViewSet, "list", "get"), "default")
+        finally:
+            patcher.stop()
+
+
+class CategoryPromptApiTests(TransactionTestCase):
+    # With DB_REPLICA_NAME set, the replica mirrors the default test database;
+    # no wrapping transaction, so the replica connection sees the writes
+    databases = set(settings.DATABASES)
+
+    def test_create_prompt_right_after_its_category(self):
+        category = self.client.post("/api/categories/", {"name": "returns", "description": "Returns"})
+        self.assertEqual(category.status_code, 201)
+        prompt = self.client.post(
+            "/api/prompts/", {"name": "A", "description": "Polite", "category": category.json()["id"]}
+        )
+        self.assertEqual(prompt.status_code, 201)
+        self.assertEqual([row["name"] for row in self.client.get("/api/prompts/").json()], ["A"])
+
+
+def fake_generator(calls, on_question=None, failing=()):
+    # Stands in for GENERATORS[...]: two variants per question, no LLM calls;
+    # the variants in `failing` raise
+    def build(job):
+        def reply(variant, question):
+            if variant in failing:
+                raise RuntimeError(f"{variant} is down")
+            return f"{variant}: {question}", 0.1
+
+        def generate(question):
+            calls.append(question)
+            if on_question is not None:
+                on_question(job, question)
+            return [(variant, lambda variant=variant: reply(variant, question)) for variant in ("A", "B")]
+        return generate
+    return build
+
+
+class EvaluationJobTests(TestCase):
+    def make_job(self, questions=("q1", "q2"), **fields):
+        return EvaluationJob.objects.create(category="General Questions", questions=list(questions),
+                                            total=len(questions), **fields)
+
+    def run_with(self, job, generator):
+        with mock.patch.dict(GENERATORS, {job.source: generator}):
+            run_job(job, "w1")
+        job.refresh_from_db()
+        return job
+
+    def test_only_one_worker_claims_a_job(self):
+        job = self.make_job()
+        self.assertEqual(claim_next_job("w1").id, job.id)
+        self.assertIsNone(claim_next_job("w2"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (EvaluationJob.Status.RUNNING, "w1"))
+
+    def test_requeue_stale_jobs(self):
+        now = timezone.now()
+        stale = self.make_job(status=EvaluationJob.Status.RUNNING, worker="w1",
+                              heartbeat_at=now - STALE_AFTER - timedelta(seconds=1))
+        alive = self.make_job(status=EvaluationJob.Status.RUNNING, worker="w2", heartbeat_at=now)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker), (EvaluationJob.Status.QUEUED, ""))
+        self.assertEqual(alive.status, EvaluationJob.Status.RUNNING)
+        self.assertEqual(claim_next_job("w3").id, stale.id)
+
+    def test_run_job_writes_one_result_per_question_and_variant(self):
+        self.make_job()
+        calls = []
+        job = self.run_with(claim_next_job("w1"), fake_generator(calls))
+        self.assertEqual((job.status, job.completed), (EvaluationJob.Status.DONE, 2))
+        self.assertEqual(job.results.count(), 4)
+
+    def test_questions_with_results_are_skipped(self):
+        job = self.make_job(("q1", "q2", "q3"))
+        EvaluationResult.objects.create(job=job, question_index=1, question="q2", variant="A", response="old")
+        calls = []
+        job = self.run_with(claim_next_job("w1"), fake_generator(calls))
+        self.assertEqual(calls, ["q1", "q3"])
+        self.assertEqual((job.status, job.completed), (EvaluationJob.Status.DONE, 3))
+
+    def test_cancel_mid_run(self):
+        self.make_job(("q1", "q2", "q3"))
+        job = claim_next_job("w1")
+        self.assertTrue(_heartbeat(job, "w1"))
+        calls = []
+        job = self.run_with(job, fake_generator(calls, on_question=lambda job, q: cancel_job(job)))
+        # The question being worked on is finished, then the worker stops
+        self.assertEqual(calls, ["q1"])
+        self.assertFalse(_heartbeat(job, "w1"))
+        self.assertEqual((job.status, job.completed), (EvaluationJob.Status.CANCELLED, 1))
+
+        _finish(job, "w1", EvaluationJob.Status.DONE)
+        job.refresh_from_db()
+        self.assertEqual(job.status, EvaluationJob.Status.CANCELLED)
+
+    def test_failing_variant_keeps_the_other_replies(self):
+        self.make_job()
+        job = self.run_with(claim_next_job("w1"), fake_generator([], failing={"B"}))
+        self.assertEqual((job.status, job.completed), (EvaluationJob.Status.DONE, 2))
+        rows = {(row.question, row.variant): (row.response, row.error) for row in job.results.all()}
+        self.assertEqual(rows[("q1", "A")], ("A: q1", ""))
+        self.assertEqual(rows[("q2", "B")], ("", "B is down"))
+        self.assertEqual(len(rows), 4)
+
+    def test_job_fails_when_every_reply_failed(self):
+        self.make_job()
+        job = self.run_with(claim_next_job("w1"), fake_generator([], failing={"A", "B"}))
+        self.assertEqual((job.status, job.completed), (EvaluationJob.Status.FAILED, 2))
+        self.assertIn("is down", job.error)
+        self.assertEqual(job.results.exclude(error="").count(), 4)
+
+    def test_generator_setup_error_fails_the_job(self):
+        self.make_job()
+
+        def broken(job):
+            raise FileNotFoundError("File not found: prompts.yaml")
+
+        job = self.run_with(claim_next_job("w1"), broken)
+        self.assertEqual((job.status, job.error), (EvaluationJob.Status.FAILED, "File not found: prompts.yaml"))
+
+
+class EvaluationJobApiTests(TestCase):
+    def create(self, **data):
+        payload = {"category": "General Questions", "questions": ["q1", "q2"], **data}
+        return self.client.post("/api/jobs/", payload, content_type="application/json")
+
+    def test_create(self):
+        response = self.create(model="Google Gemini / gemini-1.5-pro")
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["status"], body["total"]), ("queued", 2))
+        self.assertEqual(body["model"], "Google Gemini / gemini-1.5-pro")
+
+    def test_create_rejects_unknown_model(self):
+        response = self.create(model="bogus")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("model", response.json())
+
+    def test_create_rejects_model_for_prompts_yaml(self):
+        self.assertEqual(self.create(source="prompts_yaml", model="OpenAI / gpt-4o-mini").status_code, 400)
+        self.assertEqual(self.create(source="prompts_yaml").status_code, 201)
+
+    def test_create_rejects_empty_questions(self):
+        self.assertEqual(self.create(questions=[]).status_code, 400)
+
+    def test_cancel_then_conflict(self):
+        job_id = self.create().json()["id"]
+        response = self.client.post(f"/api/jobs/{job_id}/cancel/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "cancelled")
+        self.assertEqual(self.client.post(f"/api/jobs/{job_id}/cancel/").status_code, 409)
+
+
+class SharedCacheApiTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = SharedCache(os.path.join(self.tmp.name, "cache.sqlite3"))
+        patcher = mock.patch("nopreserveroot.views.get_shared_cache", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_preference_counts(self):
+        self.cache.increment_preference("Math Tutor", "A", "OpenAI / gpt-4o-mini")
+        self.cache.increment_preference("History Guide", "B", "OpenAI / gpt-4o-mini")
+        self.assertEqual(len(self.client.get("/api/preference-counts/").json()), 2)
+        rows = self.client.get("/api/preference-counts/", {"category": "Math Tutor"}).json()
+        self.assertEqual(rows, [
+            {"category": "Math Tutor", "variant": "A", "model": "OpenAI / gpt-4o-mini", "count": 1}
+        ])
+
+    def test_prompt_definitions(self):
+        self.cache.set_prompt_definition("Math Tutor", [{"name": "A"}])
+        self.assertEqual(self.client.get("/api/prompt-definitions/").json(), {"Math Tutor": [{"name": "A"}]})
+        response = self.client.get("/api/prompt-definitions/", {"category": "Math Tutor"})
+        self.assertEqual(response.json(), [{"name": "A"}])
+        self.assertEqual(self.client.get("/api/prompt-definitions/", {"category": "Biology"}).status_code, 404)
@@ -1,7 +1,14 @@
+from django.urls import path
 from rest_framework import routers
-from nopreserveroot.views import CategoryViewSet, PromptViewSet
+from nopreserveroot.views import (
+    CategoryViewSet, EvaluationJobViewSet, PreferenceCountView, PromptDefinitionView, PromptViewSet
+)
 
 router = routers.SimpleRouter()
 router.register("categories", CategoryViewSet)
 router.register("prompts", PromptViewSet)
-urlpatterns = router.urls
+router.register("jobs", EvaluationJobViewSet)
+urlpatterns = router.urls + [
+    path("preference-counts/", PreferenceCountView.as_view()),
+    path("prompt-definitions/", PromptDefinitionView.as_view()),
+]
@@ -1,14 +1,77 @@
-from rest_framework.viewsets import ModelViewSet
+from functools import lru_cache
 
-from nopreserveroot.models import Category, Prompt
-from nopreserveroot.serializers import CategorySerializer, PromptSerializer
+from rest_framework import mixins, status
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
+from llm.db_routers import replica_database
+from nopreserveroot.jobs import cancel_job
+from nopreserveroot.models import Category, EvaluationJob, Prompt
+from nopreserveroot.serializers import (
+    CategorySerializer, EvaluationJobSerializer, EvaluationResultSerializer, PromptSerializer
+)
+from shared_cache import SharedCache
 
-class PromptViewSet(ModelViewSet):
+
+@lru_cache(maxsize=1)
+def get_shared_cache():
+    return SharedCache()
+
+
+class ReplicaReadMixin:
+    # Read-only actions served from the read replica (when configured)
+    replica_actions = ("list", "retrieve")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.replica_actions and self.request.method in SAFE_METHODS:
+            return queryset.using(replica_database())
+        return queryset
+
+
+class PromptViewSet(ReplicaReadMixin, ModelViewSet):
     queryset = Prompt.objects.all()
     serializer_class = PromptSerializer
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+
+
+class EvaluationJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                           GenericViewSet):
+    queryset = EvaluationJob.objects.all()
+    serializer_class = EvaluationJobSerializer
+
+    @action(detail=True, methods=["post"])
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        if not cancel_job(job):
+            return Response({"detail": f"Job is already {job.status}."}, status=status.HTTP_409_CONFLICT)
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
+
+    @action(detail=True, methods=["get"])
+    def results(self, request, pk=None):
+        job = self.get_object()
+        return Response(EvaluationResultSerializer(job.results.all(), many=True).data)
+
+
+class PreferenceCountView(APIView):
+    def get(self, request):
+        return Response(get_shared_cache().preference_counts(request.query_params.get("category")))
+
+
+class PromptDefinitionView(APIView):
+    def get(self, request):
+        category = request.query_params.get("category")
+        if category is None:
+            return Response(get_shared_cache().prompt_definitions())
+        definition = get_shared_cache().get_prompt_definition(category)
+        if definition is None:
+            return Response({"detail": f"No prompt definition for {category}."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(definition)
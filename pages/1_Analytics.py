@@ -0,0 +1,49 @@
+# pages/1_Analytics.py
+
+import streamlit as st
+from analytics import ResultsAggregator
+
+st.set_page_config(page_title="A/B Analytics", page_icon="📊", layout="wide")
+
+
+@st.cache_resource
+def get_aggregator():
+    # Shared by all sessions; each rerun only reads segments added since the last one
+    return ResultsAggregator()
+
+
+aggregator = get_aggregator()
+new_rows = aggregator.refresh()
+
+st.title("A/B Analytics")
+st.caption(f"{aggregator.rows:,} logged replies ({new_rows:,} new since last refresh)")
+
+if not aggregator.rows:
+    st.info("No comparisons logged yet. Pick replies in the chat to collect results.")
+    st.stop()
+
+variants = aggregator.summary("variant")
+categories = sorted(variants["category"].unique())
+
+with st.sidebar:
+    selected_category = st.selectbox("Category:", ["All"] + categories)
+    if st.button("Refresh"):
+        st.rerun()
+
+if selected_category != "All":
+    variants = variants[variants["category"] == selected_category]
+
+st.header("Win rate per variant")
+st.dataframe(
+    variants,
+    hide_index=True,
+    column_config={
+        "win_rate": st.column_config.ProgressColumn("Win rate", format="%.2f", min_value=0, max_value=1),
+        "ci_low": st.column_config.NumberColumn("95% CI low", format="%.3f"),
+        "ci_high": st.column_config.NumberColumn("95% CI high", format="%.3f"),
+    },
+)
+st.bar_chart(variants, x="variant", y="win_rate", color="category")
+
+st.header("Models")
+st.dataframe(aggregator.summary("model"), hide_index=True)
@@ -0,0 +1,248 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Profiling is opt-in: set PROFILE_TRACE_DIR to write one trace per request
+PROFILE_TRACE_DIR = os.getenv("PROFILE_TRACE_DIR", "")
+# Seconds between two stack samples of the profiled threads
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# Frames kept per sampled stack
+SAMPLE_DEPTH = 30
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1000
+
+
+class Trace:
+    """
+    Timing spans and stack samples of one request, saved as a Chrome trace
+    (open in chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self, name: str, directory: str):
+        self.name = name
+        self.directory = directory
+        self.started_at = time.time()
+        self.start_us = _now_us()
+        self.token = None
+        self.sampler = None
+        self.events: List[Dict] = []
+        # (thread id, timestamp in us, stack with the outermost frame first)
+        self.samples: List[tuple] = []
+        # Threads sampled: the request thread, plus pool threads while they
+        # are inside a span of this trace (idle pool threads are skipped)
+        self.request_thread = threading.get_ident()
+        self.active_threads: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active_threads[threading.get_ident()] += 1
+
+    def leave(self):
+        with self._lock:
+            self.active_threads[threading.get_ident()] -= 1
+
+    def add_span(self, name: str, start_us: float, end_us: float, args: Dict):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.events.append({
+                "name": name, "ph": "X", "ts": start_us, "dur": end_us - start_us,
+                "pid": os.getpid(), "tid": thread_id, "args": args,
+            })
+
+    def sample(self):
+        now = _now_us()
+        frames = sys._current_frames()
+        with self._lock:
+            thread_ids = {self.request_thread} | {tid for tid, depth in self.active_threads.items() if depth > 0}
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < SAMPLE_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples.append((thread_id, now, tuple(reversed(stack))))
+
+    def _stack_samples(self):
+        """
+        Samples in the Chrome trace format: a "stackFrames" tree (one node
+        per distinct call path) and "samples" pointing at its leaves.
+        """
+        frame_ids: Dict[tuple, str] = {}
+        stack_frames: Dict[str, Dict] = {}
+        samples = []
+        for thread_id, ts, stack in self.samples:
+            parent = None
+            for depth in range(len(stack)):
+                path = stack[:depth + 1]
+                frame_id = frame_ids.get(path)
+                if frame_id is None:
+                    frame_id = frame_ids[path] = str(len(frame_ids) + 1)
+                    stack_frames[frame_id] = {"category": "python", "name": stack[depth]}
+                    if parent is not None:
+                        stack_frames[frame_id]["parent"] = parent
+                parent = frame_id
+            samples.append({"cpu": 0, "tid": thread_id, "ts": ts, "name": "sample", "sf": parent, "weight": 1})
+        return stack_frames, samples
+
+    def save(self) -> str:
+        directory = self.directory
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        path = os.path.join(directory, f"{stamp}-{self.name}-{os.getpid()}-{id(self):x}.trace.json")
+        stack_frames, samples = self._stack_samples()
+        with open(path, "w") as f:
+            json.dump({
+                "traceEvents": self.events,
+                "stackFrames": stack_frames,
+                "samples": samples,
+                "displayTimeUnit": "ms",
+                "otherData": {"name": self.name, "sample_interval_s": PROFILE_SAMPLE_INTERVAL},
+            }, f)
+        return path
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, trace: Trace, interval: float):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.trace = trace
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.trace.sample()
+
+
+def start_trace(name: str, directory: str = PROFILE_TRACE_DIR) -> Optional[Trace]:
+    """
+    Start tracing the current request. Returns None when profiling is off.
+    Finish with finish_trace; prefer profile_request, which also finishes
+    the trace when the request raises.
+    """
+    if not directory:
+        return None
+    trace = Trace(name, directory)
+    trace.token = _current_trace.set(trace)
+    trace.sampler = _Sampler(trace, PROFILE_SAMPLE_INTERVAL)
+    trace.sampler.start()
+    return trace
+
+
+def finish_trace(trace: Optional[Trace]) -> Optional[str]:
+    """
+    Stop the sampler, add the whole-request span and write the trace file.
+    """
+    if trace is None:
+        return None
+    trace.sampler.stopped.set()
+    trace.sampler.join()
+    trace.add_span(trace.name, trace.start_us, _now_us(), {})
+    _current_trace.reset(trace.token)
+    return trace.save()
+
+
+@contextmanager
+def profile_request(name: str, directory: str = PROFILE_TRACE_DIR):
+    """
+    Trace everything inside the block as one request.
+    """
+    trace = start_trace(name, directory)
+    try:
+        yield trace
+    finally:
+        finish_trace(trace)
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Time a stage of the current request. Does nothing when no trace is active.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    trace.enter()
+    start = _now_us()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, _now_us(), args)
+        trace.leave()
+
+
+def load_traces(directory: str = PROFILE_TRACE_DIR) -> List[Dict]:
+    traces = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".trace.json"):
+            with open(os.path.join(directory, name)) as f:
+                traces.append(json.load(f))
+    return traces
+
+
+def summarize(traces: List[Dict]) -> List[Dict]:
+    """
+    One row per span name: count, total, mean, p95 and max duration in ms,
+    slowest total first.
+    """
+    durations: Dict[str, List[float]] = {}
+    for trace in traces:
+        for event in trace["traceEvents"]:
+            if event.get("ph") == "X":
+                durations.setdefault(event["name"], []).append(event["dur"] / 1000)
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append({
+            "stage": name,
+            "count": len(values),
+            "total_ms": sum(values),
+            "mean_ms": sum(values) / len(values),
+            "p95_ms": values[min(len(values) - 1, int(0.95 * len(values)))],
+            "max_ms": values[-1],
+        })
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+def top_frames(traces: List[Dict], limit: int = 15) -> List[tuple]:
+    """
+    Innermost frames that were sampled most often, over all traces.
+    """
+    frames = Counter()
+    for trace in traces:
+        stack_frames = trace.get("stackFrames", {})
+        for sample in trace.get("samples", []):
+            frames[stack_frames[sample["sf"]]["name"]] += sample.get("weight", 1)
+    return frames.most_common(limit)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the slowest stages of the recorded traces")
+    parser.add_argument("directory", nargs="?", default=PROFILE_TRACE_DIR or ".")
+    parser.add_argument("--top", type=int, default=15, help="Number of sampled frames to show")
+    args = parser.parse_args()
+
+    traces = load_traces(args.directory)
+    print(f"{len(traces)} traces in {args.directory}\n")
+    print(f"{'stage':<40} {'count':>7} {'total ms':>10} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for row in summarize(traces):
+        print(f"{row['stage'][:40]:<40} {row['count']:>7} {row['total_ms']:>10.1f} {row['mean_ms']:>9.1f} "
+              f"{row['p95_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    print("\nMost sampled frames:")
+    for frame, count in top_frames(traces, args.top):
+        print(f"{count:>7}  {frame}")
@@ -1,5 +1,21 @@
-from typing import List
-from langchain.schema import SystemMessage, HumanMessage
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
+
+# Token budget for the conversation history sent with every variant
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Max tokens used for the summary of turns that were trimmed away
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))
+# When the history exceeds the budget, old turns are dropped until it is
+# below this share of the budget, so the prompt prefix then stays the same
+# for several rounds (providers with prompt caching can reuse it)
+TRIM_TARGET_RATIO = 0.5
+# Rough per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Providers that cache identical prompt prefixes server side: prompts below
+# min_tokens are never cached, longer prefixes are cached in steps of `step`
+PROMPT_CACHING_PROVIDERS = {"OpenAI": {"min_tokens": 1024, "step": 128}}
 
 
 def get_system_prompts(category: str) -> List[str]:
@@ -122,23 +138,154 @@ def get_system_prompts(category: str) -> List[str]:
         ]
 
 
-def build_chat_messages(category: str, user_input: str):
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """
+    Load the local tiktoken encoding once. Returns None when tiktoken or its
+    BPE file is not available (e.g. offline), in which case count_tokens
+    falls back to an estimate.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text with the local tokenizer.
+    Results are cached, so messages already seen in previous reruns are not
+    tokenized again.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        # ~4 characters per token for English text
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages) -> int:
+    """
+    Count the tokens of a list of chat messages (LangChain messages or
+    {"role", "content"} dicts), including the per-message overhead.
+    """
+    total = 0
+    for msg in messages:
+        content = msg["content"] if isinstance(msg, dict) else msg.content
+        total += count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+
+def summarize_turns(history: List[Dict[str, str]], max_tokens: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Build a short extractive summary of trimmed turns: the start of each
+    question and answer, newest first until max_tokens is reached.
+    """
+    lines = []
+    used = count_tokens("Earlier in this conversation:")
+    for msg in reversed(history):
+        speaker = "User" if msg["role"] == "user" else "Greg"
+        line = f"- {speaker}: {msg['content'][:120].strip()}"
+        cost = count_tokens(line)
+        if used + cost > max_tokens:
+            break
+        lines.insert(0, line)
+        used += cost
+    if not lines:
+        return ""
+    return "\n".join(["Earlier in this conversation:"] + lines)
+
+
+def build_context(history: List[Dict[str, str]], budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Fit the chat history into the token budget.
+
+    Returns (summary, kept_history):
+      - kept_history is the most recent part of the history that fits in budget.
+      - summary is a short summary of the trimmed turns ("" if nothing was trimmed).
+
+    The trimming is replayed message by message from the start of the
+    history: each time the budget is exceeded, old messages are dropped down
+    to TRIM_TARGET_RATIO of the budget. The result only depends on the
+    history, and the start of the kept history stays the same until the
+    budget is exceeded again.
+    """
+    costs = [count_message_tokens([msg]) for msg in history]
+    dropped, kept_tokens = 0, 0
+    for end, cost in enumerate(costs):
+        kept_tokens += cost
+        if kept_tokens <= budget:
+            continue
+        while dropped <= end and kept_tokens > budget * TRIM_TARGET_RATIO:
+            kept_tokens -= costs[dropped]
+            dropped += 1
+        # Never start the kept history with an assistant reply
+        while dropped <= end and history[dropped]["role"] != "user":
+            kept_tokens -= costs[dropped]
+            dropped += 1
+
+    summary = summarize_turns(history[:dropped]) if dropped else ""
+    return summary, history[dropped:]
+
+
+def cached_prefix_tokens(messages, previous_messages, model_provider: str) -> int:
+    """
+    Return how many tokens of `messages` can be served from the provider's
+    prompt cache: the identical prefix shared with the previous request,
+    rounded down to the provider's caching step, and 0 below its minimum.
+    Always 0 for providers without prompt caching.
+    """
+    caching = PROMPT_CACHING_PROVIDERS.get(model_provider)
+    if caching is None or not previous_messages:
+        return 0
+    prefix = []
+    for msg, prev in zip(messages, previous_messages):
+        if type(msg) is not type(prev) or msg.content != prev.content:
+            break
+        prefix.append(msg)
+    tokens = count_message_tokens(prefix)
+    if tokens < caching["min_tokens"]:
+        return 0
+    return caching["min_tokens"] + (tokens - caching["min_tokens"]) // caching["step"] * caching["step"]
+
+
+def build_chat_messages(category: str, user_input: str, history: Optional[List[Dict[str, str]]] = None,
+                        budget: int = CONTEXT_TOKEN_BUDGET):
     """
     Return a list of variants, each as a tuple:
-      ( [ SystemMessage(...), HumanMessage(...) ], variant_name )
+      ( [ SystemMessage(...), <history>..., HumanMessage(...) ], variant_name )
 
     - Each system‐prompt string in get_system_prompts(category) becomes one variant.
     - variant_name is "variant1", "variant2", etc., based on index.
+    - history is the previous turns ({"role", "content"} dicts, as stored in
+      st.session_state.messages), trimmed to `budget` tokens by build_context.
+      Trimmed turns are summarized at the start of the first kept user
+      message (or of the new input when nothing is kept), so the system
+      prompt never changes and user and assistant turns still alternate.
     """
     system_variations = get_system_prompts(category)
+    summary, kept_history = build_context(history or [], budget)
+
+    history_messages = [
+        HumanMessage(content=msg["content"]) if msg["role"] == "user" else AIMessage(content=msg["content"])
+        for msg in kept_history
+    ]
+    # build_context never keeps history starting with an assistant reply
+    if summary and history_messages:
+        history_messages[0] = HumanMessage(content=f"{summary}\n\n{history_messages[0].content}")
+    elif summary:
+        user_input = f"{summary}\n\n{user_input}"
+
     variants = []
-    
     for idx, sys_text in enumerate(system_variations):
         var_name = f"variant{idx+1}"
         messages = [
             SystemMessage(content=sys_text),
+            *history_messages,
             HumanMessage(content=user_input),
         ]
         variants.append((messages, var_name))
-    
+
     return variants
@@ -0,0 +1,196 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# The docker-compose "shared-data" volume is mounted at /shared in every
+# service; outside docker the cache lives next to this file
+DEFAULT_SHARED_DIR = "/shared" if os.path.isdir("/shared") else str(Path(__file__).resolve().parent / ".shared")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(DEFAULT_SHARED_DIR, "cache.sqlite3"))
+# Cached completions older than this are ignored
+COMPLETION_TTL_SECONDS = int(os.getenv("COMPLETION_TTL_SECONDS", str(24 * 3600)))
+# Expired completions are deleted once every this many writes (per process)
+PRUNE_EVERY_WRITES = int(os.getenv("COMPLETION_PRUNE_EVERY", "500"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS preference_counts (
+    category TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    model TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, variant, model)
+);
+CREATE TABLE IF NOT EXISTS model_latencies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS model_latencies_target ON model_latencies (target, id);
+CREATE TABLE IF NOT EXISTS model_rounds (
+    target TEXT PRIMARY KEY,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS prompt_definitions (
+    category TEXT PRIMARY KEY,
+    definition TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def message_key(target: str, messages) -> str:
+    """
+    Hash of the target and the messages (LangChain messages or
+    {"role", "content"} dicts), used as completion cache key.
+    """
+    payload = [
+        [msg["role"], msg["content"]] if isinstance(msg, dict) else [msg.type, msg.content]
+        for msg in messages
+    ]
+    return hashlib.sha256(json.dumps([target, payload]).encode("utf-8")).hexdigest()
+
+
+class SharedCache:
+    """
+    Process-safe cache stored in one SQLite file in WAL mode, so several
+    Streamlit replicas and the Django API can read and write it at the same
+    time. Holds completions, preference counters, model latencies and win
+    counts, and prompt definitions.
+
+    Each thread gets its own connection (sqlite3 connections must not be
+    shared between threads).
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, prune_every: int = PRUNE_EVERY_WRITES):
+        self.path = path
+        self.prune_every = prune_every
+        self._writes = itertools.count(1)
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit: every statement is its own short transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    # Completions
+
+    def get_completion(self, target: str, messages, ttl: int = COMPLETION_TTL_SECONDS) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT content FROM completions WHERE key = ? AND created_at >= ?",
+            (message_key(target, messages), time.time() - ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_completion(self, target: str, messages, content: str):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO completions (key, target, content, created_at) VALUES (?, ?, ?, ?)",
+            (message_key(target, messages), target, content, time.time()),
+        )
+        # Expired rows are only skipped on read; delete them now and then
+        # so the file on the shared volume doesn't grow forever
+        if next(self._writes) % self.prune_every == 0:
+            self.prune_completions()
+
+    def prune_completions(self, ttl: int = COMPLETION_TTL_SECONDS) -> int:
+        cursor = self._connect().execute("DELETE FROM completions WHERE created_at < ?", (time.time() - ttl,))
+        return cursor.rowcount
+
+    # Preference counters
+
+    def increment_preference(self, category: str, variant: str, model: str):
+        self._connect().execute(
+            "INSERT INTO preference_counts (category, variant, model, count) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (category, variant, model) DO UPDATE SET count = count + 1",
+            (category, variant, model),
+        )
+
+    def preference_counts(self, category: Optional[str] = None) -> List[Dict]:
+        query = "SELECT category, variant, model, count FROM preference_counts"
+        params = ()
+        if category is not None:
+            query += " WHERE category = ?"
+            params = (category,)
+        rows = self._connect().execute(query + " ORDER BY count DESC", params).fetchall()
+        return [{"category": c, "variant": v, "model": m, "count": n} for c, v, m, n in rows]
+
+    # Model latencies and rounds (fan-out comparisons)
+
+    def record_latency(self, target: str, seconds: float, window: int):
+        conn = self._connect()
+        conn.execute("INSERT INTO model_latencies (target, seconds) VALUES (?, ?)", (target, seconds))
+        # Keep only the last `window` latencies per target
+        conn.execute(
+            "DELETE FROM model_latencies WHERE target = ? AND id <= "
+            "(SELECT id FROM model_latencies WHERE target = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (target, target, window),
+        )
+
+    def recent_latencies(self, window: int) -> Dict[str, List[float]]:
+        rows = self._connect().execute(
+            "SELECT target, seconds FROM ("
+            "  SELECT target, seconds, id, ROW_NUMBER() OVER (PARTITION BY target ORDER BY id DESC) AS rn"
+            "  FROM model_latencies"
+            ") WHERE rn <= ? ORDER BY id",
+            (window,),
+        ).fetchall()
+        latencies: Dict[str, List[float]] = {}
+        for target, seconds in rows:
+            latencies.setdefault(target, []).append(seconds)
+        return latencies
+
+    def record_round(self, targets: List[str], winner: Optional[str]):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for target in set(targets):
+                conn.execute(
+                    "INSERT INTO model_rounds (target, rounds, wins) VALUES (?, 1, ?) "
+                    "ON CONFLICT (target) DO UPDATE SET rounds = rounds + 1, wins = wins + excluded.wins",
+                    (target, int(target == winner)),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def model_rounds(self) -> Dict[str, Dict[str, int]]:
+        rows = self._connect().execute("SELECT target, rounds, wins FROM model_rounds").fetchall()
+        return {target: {"rounds": rounds, "wins": wins} for target, rounds, wins in rows}
+
+    # Prompt definitions
+
+    def get_prompt_definition(self, category: str):
+        row = self._connect().execute(
+            "SELECT definition FROM prompt_definitions WHERE category = ?", (category,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_prompt_definition(self, category: str, definition):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO prompt_definitions (category, definition, updated_at) VALUES (?, ?, ?)",
+            (category, json.dumps(definition), time.time()),
+        )
+
+    def prompt_definitions(self) -> Dict[str, object]:
+        rows = self._connect().execute("SELECT category, definition FROM prompt_definitions").fetchall()
+        return {category: json.loads(definition) for category, definition in rows}
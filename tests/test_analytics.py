@@ -0,0 +1,166 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+
+from analytics import (
+    ResultsAggregator, compact_segments, import_langchain_log, list_segments, read_segments, record_comparison,
+    segment_sources, wilson_interval
+)
+
+LOGS_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nopreserveroot", "logs.csv")
+
+
+def option(target, variant, latency=1.0):
+    return {"target": target, "variant": variant, "latency": latency}
+
+
+class WilsonIntervalTests(TestCase):
+    def test_known_values(self):
+        low, high = wilson_interval([5], [10])
+        self.assertAlmostEqual(low[0], 0.2366, places=4)
+        self.assertAlmostEqual(high[0], 0.7634, places=4)
+
+    def test_bounds(self):
+        low, high = wilson_interval([0, 10, 3], [10, 10, 7])
+        self.assertEqual(low[0], 0.0)
+        self.assertAlmostEqual(high[1], 1.0)
+        self.assertTrue(np.all(low <= np.array([0, 10, 3]) / np.array([10, 10, 7])))
+        self.assertTrue(np.all(high <= 1.0))
+
+    def test_no_rounds(self):
+        low, high = wilson_interval([0], [0])
+        self.assertEqual((low[0], high[0]), (0.0, 1.0))
+
+
+class ResultsAggregatorTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def summary(self, aggregator, key="variant"):
+        columns = aggregator.GROUPS[key]
+        return {tuple(row[columns]): (row["n"], row["wins"]) for _, row in aggregator.summary(key).iterrows()}
+
+    def test_incremental_refresh(self):
+        aggregator = ResultsAggregator(self.dir)
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 0, self.dir)
+        self.assertEqual(aggregator.refresh(), 2)
+        self.assertEqual(aggregator.refresh(), 0)
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 1, self.dir)
+        self.assertEqual(aggregator.refresh(), 2)
+        self.assertEqual(self.summary(aggregator), {("math", "A"): (2, 1), ("math", "B"): (2, 1)})
+        self.assertEqual(self.summary(aggregator, "model"), {("m1",): (2, 1), ("m2",): (2, 1)})
+        self.assertIn("p95_s", aggregator.summary())
+
+    def test_single_model_rounds_are_not_model_rows(self):
+        aggregator = ResultsAggregator(self.dir)
+        record_comparison("math", [option("m1", "A"), option("m1", "B")], 0, self.dir)
+        record_comparison("math", [option("m1", "A"), option("m2", "A")], 1, self.dir)
+        aggregator.refresh()
+        self.assertEqual(self.summary(aggregator), {("math", "A"): (3, 2), ("math", "B"): (1, 0)})
+        self.assertEqual(self.summary(aggregator, "model"), {("m1",): (1, 0), ("m2",): (1, 1)})
+
+    def test_compaction_keeps_counts(self):
+        aggregator = ResultsAggregator(self.dir)
+        for winner in (0, 1, 0):
+            record_comparison("math", [option("m1", "A"), option("m2", "B")], winner, self.dir)
+        aggregator.refresh()
+
+        self.assertEqual(compact_segments(self.dir, tier_factor=3), 2)
+        self.assertEqual(segment_sources(list_segments(self.dir)[0], self.dir)[0][1], 2)
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 1, self.dir)
+        self.assertEqual(aggregator.refresh(), 2)
+        self.assertEqual(aggregator.rows, 8)
+        self.assertEqual(self.summary(aggregator), {("math", "A"): (4, 2), ("math", "B"): (4, 2)})
+        fresh = ResultsAggregator(self.dir)
+        fresh.refresh()
+        self.assertEqual(self.summary(fresh), self.summary(aggregator))
+
+    def test_merged_segment_listed_with_its_sources(self):
+        # A reader listing the directory after the merged segment is written
+        # but before the old ones are deleted counts every row once
+        for winner in (0, 1):
+            record_comparison("math", [option("m1", "A"), option("m2", "B")], winner, self.dir)
+        with mock.patch("analytics.os.remove"):
+            compact_segments(self.dir, tier_factor=2)
+        self.assertEqual(len(list_segments(self.dir)), 3)
+        aggregator = ResultsAggregator(self.dir)
+        self.assertEqual(aggregator.refresh(), 4)
+        self.assertEqual(self.summary(aggregator), {("math", "A"): (2, 1), ("math", "B"): (2, 1)})
+
+    def test_refresh_compacts_many_segments(self):
+        aggregator = ResultsAggregator(self.dir, compact_after=3, tier_factor=4)
+        for winner in (0, 1, 0, 1):
+            record_comparison("math", [option("m1", "A"), option("m2", "B")], winner, self.dir)
+        self.assertEqual(aggregator.refresh(), 8)
+        self.assertEqual(len(list_segments(self.dir)), 1)
+
+    def test_refresh_after_compaction_does_not_rebuild(self):
+        aggregator = ResultsAggregator(self.dir, compact_after=5, tier_factor=3)
+        with mock.patch.object(aggregator, "_reset", wraps=aggregator._reset) as reset:
+            for round_ in range(6):
+                for winner in (0, 1, 0, 1, 0, 1):
+                    record_comparison("math", [option("m1", "A"), option("m2", "B")], winner, self.dir)
+                self.assertEqual(aggregator.refresh(), 12)
+            self.assertEqual(aggregator.refresh(), 0)
+        reset.assert_not_called()
+        self.assertEqual(self.summary(aggregator), {("math", "A"): (36, 18), ("math", "B"): (36, 18)})
+        # Merged segments are only merged again once their own tier fills up
+        self.assertLessEqual(len(list_segments(self.dir)), 5)
+        self.assertTrue(any(segment_sources(name, self.dir) for name in list_segments(self.dir)))
+
+    def test_compaction_by_another_process_reads_only_unread_rows(self):
+        aggregator = ResultsAggregator(self.dir)
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 0, self.dir)
+        aggregator.refresh()
+        # Not read yet when another process merges it with the first one
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 1, self.dir)
+        compact_segments(self.dir, tier_factor=2)
+        with mock.patch.object(aggregator, "_reset", wraps=aggregator._reset) as reset:
+            self.assertEqual(aggregator.refresh(), 2)
+        reset.assert_not_called()
+        self.assertEqual(self.summary(aggregator), {("math", "A"): (2, 1), ("math", "B"): (2, 1)})
+
+    def test_rebuild_reports_only_new_rows(self):
+        aggregator = ResultsAggregator(self.dir)
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 0, self.dir)
+        aggregator.refresh()
+        for name in list_segments(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        import_langchain_log(LOGS_CSV, self.dir)
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 1, self.dir)
+        self.assertEqual(aggregator.refresh(), 6)
+        self.assertEqual(aggregator.rows, 8)
+
+    def test_refresh_retries_when_a_segment_disappears(self):
+        record_comparison("math", [option("m1", "A"), option("m2", "B")], 0, self.dir)
+        aggregator = ResultsAggregator(self.dir)
+        real_read = read_segments
+        calls = []
+
+        def flaky_read(names, directory):
+            calls.append(names)
+            if len(calls) == 1:
+                raise FileNotFoundError(names[0])
+            return real_read(names, directory)
+
+        with mock.patch("analytics.read_segments", flaky_read):
+            self.assertEqual(aggregator.refresh(), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_import_shipped_langchain_log(self):
+        # Old header; the last row is an A/B comparison appended under it
+        self.assertEqual(import_langchain_log(LOGS_CSV, self.dir), 6)
+        table = read_segments(list_segments(self.dir), self.dir).to_pandas()
+        self.assertEqual(sorted(table["variant"]), ["A", "A", "A", "A", "B", "B"])
+        compared = table[table["category"] == "general"]
+        self.assertEqual(dict(zip(compared["variant"], compared["won"])), {"A": True, "B": False})
+
+        aggregator = ResultsAggregator(self.dir)
+        aggregator.refresh()
+        self.assertEqual(self.summary(aggregator, "model"), {})
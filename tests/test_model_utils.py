@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+from model_utils import LatencyTracker, fan_out, hedged_invoke
+from shared_cache import SharedCache
+
+
+class LatencyTrackerTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = SharedCache(os.path.join(self.tmp.name, "cache.sqlite3"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_p95_needs_enough_samples(self):
+        tracker = LatencyTracker()
+        for seconds in (1, 2, 3, 4):
+            tracker.record_latency("a", seconds)
+        self.assertIsNone(tracker.p95("a"))
+        tracker.record_latency("a", 5)
+        self.assertEqual(tracker.p95("a"), 5)
+
+    def test_summary_while_recording_from_threads(self):
+        tracker = LatencyTracker(window=50)
+        stop = threading.Event()
+
+        def record():
+            i = 0
+            while not stop.is_set():
+                tracker.record_latency(f"t{i % 20}", 0.1)
+                i += 1
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(200):
+                tracker.summary()
+                tracker.p95("t1")
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def test_counters_are_shared_through_the_store(self):
+        first = LatencyTracker(window=3, store=self.store)
+        for seconds in (1.0, 2.0, 3.0, 4.0):
+            first.record_latency("a", seconds)
+        first.record_round(["a", "b"], "a")
+        first.record_round(["a", "b"], "b")
+
+        second = LatencyTracker(window=3, store=self.store)
+        self.assertEqual(list(second.latencies["a"]), [2.0, 3.0, 4.0])
+        rows = {row["target"]: row for row in second.summary()}
+        self.assertEqual((rows["a"]["rounds"], rows["a"]["wins"]), (2, 1))
+        self.assertEqual(rows["b"]["win_rate"], 0.5)
+
+        first.record_round(["a", "b"], "a")
+        second.reload()
+        self.assertEqual(second.wins["a"], 2)
+
+
+class FakeLLM:
+    def __init__(self, name, delay=0.0, error=None):
+        self.model_name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(content=f"{self.model_name}: {messages}")
+
+
+class HedgedInvokeTests(TestCase):
+    def tracker_with_p95(self, target, seconds):
+        tracker = LatencyTracker()
+        for _ in range(5):
+            tracker.record_latency(target, seconds)
+        return tracker
+
+    def test_fast_primary_is_not_hedged(self):
+        llms = {"p": FakeLLM("p"), "b": FakeLLM("b")}
+        target, text, _ = hedged_invoke(llms, "p", "b", "hi", self.tracker_with_p95("p", 1.0))
+        self.assertEqual((target, text), ("p", "p: hi"))
+        self.assertEqual(llms["b"].calls, 0)
+
+    def test_backup_sent_after_primary_p95(self):
+        llms = {"p": FakeLLM("p", delay=1.0), "b": FakeLLM("b", delay=0.01)}
+        tracker = self.tracker_with_p95("p", 0.05)
+        start = time.perf_counter()
+        target, text, latency = hedged_invoke(llms, "p", "b", "hi", tracker)
+        self.assertEqual((target, text), ("b", "b: hi"))
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertLess(latency, 0.5)
+
+    def test_primary_failing_fast_falls_back_without_waiting(self):
+        # No p95 yet: the hedge timeout would be DEFAULT_HEDGE_AFTER_SECONDS
+        llms = {"p": FakeLLM("p", error=RuntimeError("quota")), "b": FakeLLM("b")}
+        start = time.perf_counter()
+        target, text, _ = hedged_invoke(llms, "p", "b", "hi", LatencyTracker())
+        self.assertEqual((target, text), ("b", "b: hi"))
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_raises_when_both_fail(self):
+        llms = {"p": FakeLLM("p", error=RuntimeError("p down")), "b": FakeLLM("b", error=RuntimeError("b down"))}
+        with self.assertRaises(RuntimeError):
+            hedged_invoke(llms, "p", "b", "hi", LatencyTracker())
+
+    def test_without_backup(self):
+        llms = {"p": FakeLLM("p", error=ValueError("bad request"))}
+        with self.assertRaises(ValueError):
+            hedged_invoke(llms, "p", None, "hi", LatencyTracker())
+
+
+class FanOutTests(TestCase):
+    def test_results_in_completion_order_with_error_rows(self):
+        llms = {
+            "slow": FakeLLM("slow", delay=0.3),
+            "fast": FakeLLM("fast"),
+            "down": FakeLLM("down", error=RuntimeError("503")),
+        }
+        tracker = LatencyTracker()
+        rows = list(fan_out(llms, [("slow", "a"), ("fast", "b"), ("down", "c")], tracker))
+
+        self.assertEqual(rows[-1][:2], (0, "slow: a"))
+        by_idx = {idx: (text, latency, error) for idx, text, latency, error in rows}
+        self.assertEqual(by_idx[1][0], "fast: b")
+        text, latency, error = by_idx[2]
+        self.assertEqual((text, latency, str(error)), ("", None, "503"))
+        self.assertEqual(set(tracker.latencies), {"slow", "fast"})
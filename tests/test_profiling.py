@@ -0,0 +1,50 @@
+import json
+import tempfile
+import time
+from unittest import TestCase
+
+from profiling import _current_trace, load_traces, profile_request, span, summarize, top_frames
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_off_without_directory(self):
+        with profile_request("request", directory="") as trace:
+            with span("stage"):
+                pass
+        self.assertIsNone(trace)
+
+    def test_chrome_trace_format(self):
+        with profile_request("request", directory=self.tmp.name) as trace:
+            with span("stage", model="m"):
+                busy(0.05)
+        [saved] = load_traces(self.tmp.name)
+        self.assertEqual({row["stage"] for row in summarize([saved])}, {"request", "stage"})
+
+        frames, samples = saved["stackFrames"], saved["samples"]
+        self.assertTrue(samples)
+        for sample in samples:
+            self.assertIn(sample["sf"], frames)
+            self.assertEqual(sample["tid"], trace.request_thread)
+        for frame in frames.values():
+            self.assertTrue(frame.get("parent") is None or frame["parent"] in frames)
+        self.assertIn("busy", json.dumps(top_frames([saved])))
+
+    def test_finished_when_the_request_raises(self):
+        with self.assertRaises(RuntimeError):
+            with profile_request("request", directory=self.tmp.name) as trace:
+                raise RuntimeError("st.stop()")
+        self.assertFalse(trace.sampler.is_alive())
+        self.assertIsNone(_current_trace.get())
+        self.assertEqual(len(load_traces(self.tmp.name)), 1)
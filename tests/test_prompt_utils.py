@@ -0,0 +1,103 @@
+from unittest import TestCase
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from prompt_utils import (
+    TRIM_TARGET_RATIO, build_chat_messages, build_context, cached_prefix_tokens, count_message_tokens,
+    summarize_turns,
+)
+
+
+def make_history(turns, words=40):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} " + "word " * words})
+        history.append({"role": "assistant", "content": f"answer {i} " + "word " * words})
+    return history
+
+
+class BuildContextTests(TestCase):
+    def test_empty_history(self):
+        self.assertEqual(build_context([], budget=100), ("", []))
+
+    def test_history_at_budget_is_kept(self):
+        history = make_history(3)
+        budget = count_message_tokens(history)
+        self.assertEqual(build_context(history, budget=budget), ("", history))
+
+    def test_history_over_budget_is_trimmed_below_target(self):
+        history = make_history(3)
+        budget = count_message_tokens(history) - 1
+        summary, kept = build_context(history, budget=budget)
+        self.assertTrue(summary)
+        self.assertEqual(kept, history[len(history) - len(kept):])
+        self.assertLessEqual(count_message_tokens(kept), budget * TRIM_TARGET_RATIO)
+
+    def test_kept_history_never_starts_with_assistant(self):
+        history = make_history(6)
+        for budget in range(50, count_message_tokens(history), 25):
+            _, kept = build_context(history, budget=budget)
+            if kept:
+                self.assertEqual(kept[0]["role"], "user")
+
+    def test_everything_dropped_when_one_message_exceeds_budget(self):
+        history = [{"role": "user", "content": "word " * 500}]
+        summary, kept = build_context(history, budget=50)
+        self.assertEqual(kept, [])
+        self.assertTrue(summary.startswith("Earlier in this conversation:"))
+
+
+class SummarizeTurnsTests(TestCase):
+    def test_empty(self):
+        self.assertEqual(summarize_turns([]), "")
+
+    def test_keeps_newest_lines_within_budget(self):
+        history = make_history(20)
+        summary = summarize_turns(history, max_tokens=60)
+        self.assertIn("answer 19", summary)
+        self.assertNotIn("question 0 ", summary)
+
+
+class PrefixStabilityTests(TestCase):
+    def test_system_prompt_is_identical_in_every_round(self):
+        first = build_chat_messages("Math Tutor", "hi", make_history(1), budget=10_000)
+        trimmed = build_chat_messages("Math Tutor", "hi", make_history(40), budget=500)
+        self.assertEqual(first[0][0][0].content, trimmed[0][0][0].content)
+        self.assertIsInstance(trimmed[0][0][0], SystemMessage)
+        self.assertIsInstance(trimmed[0][0][1], HumanMessage)
+        self.assertTrue(trimmed[0][0][1].content.startswith("Earlier in this conversation:"))
+
+    def test_user_and_assistant_turns_alternate(self):
+        for history in (make_history(40), make_history(40) + [{"role": "user", "content": "word " * 2000}]):
+            messages = build_chat_messages("Math Tutor", "hi", history, budget=500)[0][0]
+            roles = [type(msg) for msg in messages[1:]]
+            self.assertTrue(all(a is not b for a, b in zip(roles, roles[1:])), roles)
+            self.assertIn("Earlier in this conversation:", messages[1].content)
+
+    def test_prefix_is_reused_in_most_rounds(self):
+        history, previous, cached = [], None, []
+        for i in range(30):
+            messages = build_chat_messages("Math Tutor", f"question {i}", history, budget=4000)[0][0]
+            cached.append(cached_prefix_tokens(messages, previous, "OpenAI"))
+            previous = messages
+            history += [
+                {"role": "user", "content": f"question {i} " + "word " * 150},
+                {"role": "assistant", "content": f"answer {i} " + "word " * 150},
+            ]
+        # Once the prompt is long enough to be cached, the history is reused
+        # between trims
+        self.assertEqual(cached[:4], [0, 0, 0, 0])
+        self.assertGreaterEqual(sum(tokens >= 1024 for tokens in cached), 20)
+
+    def test_no_cached_prefix_without_prompt_caching(self):
+        messages = [SystemMessage(content="a " * 2000), HumanMessage(content="b"), AIMessage(content="c")]
+        self.assertEqual(cached_prefix_tokens(messages, messages, "Google Gemini"), 0)
+
+    def test_openai_minimum_and_step(self):
+        short = [SystemMessage(content="a"), HumanMessage(content="b")]
+        self.assertEqual(cached_prefix_tokens(short, short, "OpenAI"), 0)
+        messages = [SystemMessage(content="word " * 1200), HumanMessage(content="b")]
+        tokens = count_message_tokens(messages)
+        cached = cached_prefix_tokens(messages, messages, "OpenAI")
+        self.assertEqual((cached - 1024) % 128, 0)
+        self.assertTrue(tokens - 128 < cached <= tokens)
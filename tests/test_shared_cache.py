@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from shared_cache import SharedCache, message_key
+
+
+class MessageKeyTests(TestCase):
+    def test_dict_and_langchain_messages_match(self):
+        dicts = [{"role": "system", "content": "Be brief."}, {"role": "human", "content": "Hi"}]
+        messages = [SystemMessage(content="Be brief."), HumanMessage(content="Hi")]
+        self.assertEqual(message_key("OpenAI / gpt-4o-mini", dicts), message_key("OpenAI / gpt-4o-mini", messages))
+
+    def test_target_and_content_change_the_key(self):
+        messages = [HumanMessage(content="Hi")]
+        key = message_key("OpenAI / gpt-4o-mini", messages)
+        self.assertNotEqual(key, message_key("OpenAI / gpt-3.5-turbo", messages))
+        self.assertNotEqual(key, message_key("OpenAI / gpt-4o-mini", [HumanMessage(content="Hi!")]))
+
+
+class SharedCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = SharedCache(os.path.join(self.tmp.name, "cache.sqlite3"))
+        self.messages = [HumanMessage(content="Hi")]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def count_completions(cache):
+        return cache._connect().execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def test_completion_ttl(self):
+        self.cache.set_completion("m", self.messages, "Hello")
+        self.assertEqual(self.cache.get_completion("m", self.messages), "Hello")
+        self.assertIsNone(self.cache.get_completion("other", self.messages))
+        with mock.patch("shared_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(self.cache.get_completion("m", self.messages, ttl=60))
+            self.assertEqual(self.cache.prune_completions(ttl=60), 1)
+        self.assertIsNone(self.cache.get_completion("m", self.messages))
+
+    def test_expired_completions_are_pruned_on_write(self):
+        cache = SharedCache(self.cache.path, prune_every=3)
+        with mock.patch("shared_cache.time.time", return_value=time.time() - 2 * 24 * 3600):
+            cache.set_completion("old", self.messages, "stale")
+        cache.set_completion("a", self.messages, "1")
+        self.assertEqual(self.count_completions(cache), 2)
+        cache.set_completion("b", self.messages, "2")
+        self.assertEqual(self.count_completions(cache), 2)
+
+    def test_preference_upsert(self):
+        for _ in range(3):
+            self.cache.increment_preference("Math Tutor", "A", "OpenAI / gpt-4o-mini")
+        self.cache.increment_preference("Math Tutor", "B", "OpenAI / gpt-4o-mini")
+        self.cache.increment_preference("History Guide", "A", "OpenAI / gpt-4o-mini")
+        self.assertEqual(
+            [(row["variant"], row["count"]) for row in self.cache.preference_counts("Math Tutor")],
+            [("A", 3), ("B", 1)],
+        )
+        self.assertEqual(len(self.cache.preference_counts()), 3)
+
+    def test_prompt_definitions(self):
+        self.cache.set_prompt_definition("Math Tutor", [{"name": "A", "prompt": "Explain step by step."}])
+        self.cache.set_prompt_definition("Math Tutor", [{"name": "A", "prompt": "Be concise."}])
+        self.assertEqual(self.cache.get_prompt_definition("Math Tutor"), [{"name": "A", "prompt": "Be concise."}])
+        self.assertIsNone(self.cache.get_prompt_definition("History Guide"))
+        self.assertEqual(list(self.cache.prompt_definitions()), ["Math Tutor"])
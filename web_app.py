@@ -1,179 +1,300 @@
 # web_app.py
 
-import os
 import random
 from dotenv import load_dotenv
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from prompt_utils import build_chat_messages
+from analytics import record_comparison
+from model_utils import (
+    DEFAULT_MODELS, LatencyTracker, configured_targets, create_llm, fan_out, hedged_invoke, invoke_llm, split_target
+)
+from profiling import profile_request, span
+from prompt_utils import build_chat_messages, count_message_tokens, cached_prefix_tokens, get_system_prompts
+from shared_cache import SharedCache
 
 # Page setup
 st.set_page_config(page_title="Ask Greg", page_icon="🤖", layout="wide")
 load_dotenv()
 
-# Sidebar: choose model and category
-with st.sidebar:
-    st.header("Model Selection")
-    model_provider = st.selectbox("Choose AI Model:", ["Google Gemini", "OpenAI"])
+CATEGORIES = ["General Questions", "Programming Help", "Biology Assistant", "History Guide", "Math Tutor"]
 
-    st.header("Categories")
-    categories = ["General Questions", "Programming Help", "Biology Assistant", "History Guide", "Math Tutor"]
-    selected_category = st.selectbox("Select Category:", categories)
 
-    if model_provider == "Google Gemini":
-        google_key = os.getenv("GOOGLE_API_KEY")
-        if not google_key:
-            st.error("No GOOGLE_API_KEY found. Add it to your .env file.")
-            st.stop()
-        llm_gemini = ChatGoogleGenerativeAI(google_api_key=google_key, model="gemini-1.5-flash", temperature=0.7)
-    else:
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if not openai_key:
-            st.error("No OPENAI_API_KEY found. Add it to your .env file.")
+@st.cache_resource
+def get_llm(target):
+    # Clients are shared across reruns and sessions
+    provider, model = split_target(target)
+    return create_llm(provider, model)
+
+
+@st.cache_resource
+def get_shared_cache():
+    # One cache per process, backed by the volume shared with other replicas and Django
+    cache = SharedCache()
+    for category in CATEGORIES:
+        cache.set_prompt_definition(category, get_system_prompts(category))
+    return cache
+
+
+@st.cache_resource
+def get_latency_tracker():
+    # Shared by all sessions of this process, persisted in the shared cache
+    return LatencyTracker(store=get_shared_cache())
+
+
+def main():
+    # Sidebar: choose model and category
+    with st.sidebar:
+        st.header("Model Selection")
+        mode = st.radio("Mode:", ["Single model", "Fan-out (compare models)"])
+        available_targets = configured_targets()
+        hedge_target = None
+
+        if mode == "Single model":
+            model_provider = st.selectbox("Choose AI Model:", ["Google Gemini", "OpenAI"])
+            targets = [f"{model_provider} / {DEFAULT_MODELS[model_provider]}"]
+
+            backups = [t for t in available_targets if split_target(t)[0] != model_provider]
+            if backups and st.checkbox("Hedge slow requests with another provider"):
+                hedge_target = st.selectbox("Backup model:", backups)
+        else:
+            # One model per configured provider, so the default compares providers
+            default_targets = [
+                f"{provider} / {model}" for provider, model in DEFAULT_MODELS.items()
+                if f"{provider} / {model}" in available_targets
+            ]
+            targets = st.multiselect("Models to compare:", available_targets, default=default_targets)
+            same_variant = st.checkbox("Send the same variant to every model")
+            if not targets:
+                st.warning("Select at least one model (set GOOGLE_API_KEY and/or OPENAI_API_KEY in your .env file).")
+                st.stop()
+
+        st.header("Categories")
+        selected_category = st.selectbox("Select Category:", CATEGORIES)
+        reuse_cached = st.checkbox("Reuse cached replies", value=True)
+
+        try:
+            with span("client_construction"):
+                llms = {target: get_llm(target) for target in targets + ([hedge_target] if hedge_target else [])}
+        except ValueError as e:
+            st.error(str(e))
             st.stop()
-        llm_openai = ChatOpenAI(api_key=openai_key, model="gpt-3.5-turbo", temperature=0.7)
-
-# Main UI
-st.title("Ask Greg - Your AI Assistant")
-
-# Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "preferences" not in st.session_state:
-    st.session_state.preferences = []
-if "pending_selection" not in st.session_state:
-    st.session_state.pending_selection = None
-if "show_preference_history" not in st.session_state:
-    st.session_state.show_preference_history = False
-
-# Display chat history
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
-
-# New user input
-if user_input := st.chat_input("Ask Greg anything..."):
-    st.chat_message("user").markdown(user_input)
-    st.session_state.messages.append({"role": "user", "content": user_input})
-
-    variants = build_chat_messages(selected_category, user_input)
-
-    def count_picks(var_name, category_name):
-        return sum(
-            1 for p in st.session_state.preferences
-            if p["category"] == category_name and p["chosen_variant"] == var_name
-        )
-
-    variant_counts = [(count_picks(name, selected_category), name, msgs) for msgs, name in variants]
-    max_count = max(cnt for cnt, _, _ in variant_counts)
-    top_ties = [(name, msgs) for cnt, name, msgs in variant_counts if cnt == max_count]
-    first_var, first_msgs = random.choice(top_ties)
-
-    remaining = [(msgs, name) for msgs, name in variants if name != first_var]
-    if remaining:
-        second_msgs, second_var = random.choice(remaining)
-    else:
-        second_msgs, second_var = first_msgs, first_var
-
-    left_content = right_content = ""
-    try:
-        if model_provider == "Google Gemini":
-            system_left = first_msgs[0].content
-            gemini_left = [("system", system_left), ("human", user_input)]
-            out_left = llm_gemini.invoke(gemini_left)
-            left_content = out_left.content
-
-            system_right = second_msgs[0].content
-            gemini_right = [("system", system_right), ("human", user_input)]
-            out_right = llm_gemini.invoke(gemini_right)
-            right_content = out_right.content
+
+    # Main UI
+    st.title("Ask Greg - Your AI Assistant")
+
+    # Initialize session state
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+    if "preferences" not in st.session_state:
+        st.session_state.preferences = []
+    if "pending_selection" not in st.session_state:
+        st.session_state.pending_selection = None
+    if "show_preference_history" not in st.session_state:
+        st.session_state.show_preference_history = False
+    if "last_prompts" not in st.session_state:
+        st.session_state.last_prompts = {}
+    shared_cache = get_shared_cache()
+    tracker = get_latency_tracker()
+
+    # Display chat history
+    with span("render_history"):
+        for msg in st.session_state.messages:
+            with st.chat_message(msg["role"]):
+                st.markdown(msg["content"])
+
+    # New user input
+    if user_input := st.chat_input("Ask Greg anything..."):
+        st.chat_message("user").markdown(user_input)
+        st.session_state.messages.append({"role": "user", "content": user_input})
+
+        # History without the message just added (it is sent as the new input)
+        with span("build_chat_messages"):
+            variants = build_chat_messages(selected_category, user_input, history=st.session_state.messages[:-1])
+
+        def count_picks(var_name, category_name):
+            return sum(
+                1 for p in st.session_state.preferences
+                if p["category"] == category_name and p["chosen_variant"] == var_name
+            )
+
+        variant_counts = [(count_picks(name, selected_category), name, msgs) for msgs, name in variants]
+        max_count = max(cnt for cnt, _, _ in variant_counts)
+        top_ties = [(name, msgs) for cnt, name, msgs in variant_counts if cnt == max_count]
+        first_var, first_msgs = random.choice(top_ties)
+
+        remaining = [(msgs, name) for msgs, name in variants if name != first_var]
+
+        # Each option is one reply shown side by side: (target, variant, messages)
+        if mode == "Single model":
+            if remaining:
+                second_msgs, second_var = random.choice(remaining)
+            else:
+                second_msgs, second_var = first_msgs, first_var
+            options = [(targets[0], first_var, first_msgs), (targets[0], second_var, second_msgs)]
+        elif same_variant:
+            options = [(target, first_var, first_msgs) for target in targets]
         else:
-            resp_left = llm_openai.generate([first_msgs])
-            left_content = resp_left.generations[0][0].text
-
-            resp_right = llm_openai.generate([second_msgs])
-            right_content = resp_right.generations[0][0].text
-    except Exception as e:
-        st.error(f"Error generating response:\n{e}")
-
-    st.session_state.pending_selection = {
-        "user_input": user_input,
-        "first_var": first_var,
-        "second_var": second_var,
-        "left_content": left_content,
-        "right_content": right_content,
-        "model_provider": model_provider,
-        "selected_category": selected_category
-    }
-
-# Show two response options
-if st.session_state.pending_selection:
-    pending = st.session_state.pending_selection
-    col1, col2 = st.columns(2)
-
-    with col1:
-        st.markdown(f"**Reply (Category: {pending['selected_category']}, Variant: {pending['first_var']}):**")
-        st.markdown(pending['left_content'])
-        if st.button("Select This Reply (Left)", key=f"left_{len(st.session_state.messages)}"):
-            st.session_state.messages.append({"role": "assistant", "content": pending['left_content']})
-            st.session_state.preferences.append({
-                "question": pending['user_input'],
-                "chosen_variant": pending['first_var'],
-                "chosen_text": pending['left_content'],
-                "model": pending['model_provider'],
-                "category": pending['selected_category']
-            })
-            st.session_state.pending_selection = None
-            st.rerun()
+            # Best variant for the first model, distinct random variants for the others
+            others = random.sample(remaining, min(len(remaining), len(targets) - 1))
+            picks = [(first_msgs, first_var)] + others
+            options = [(target, picks[i % len(picks)][1], picks[i % len(picks)][0]) for i, target in enumerate(targets)]
 
-    with col2:
-        st.markdown(f"**Reply (Category: {pending['selected_category']}, Variant: {pending['second_var']}):**")
-        st.markdown(pending['right_content'])
-        if st.button("Select This Reply (Right)", key=f"right_{len(st.session_state.messages)}"):
-            st.session_state.messages.append({"role": "assistant", "content": pending['right_content']})
-            st.session_state.preferences.append({
-                "question": pending['user_input'],
-                "chosen_variant": pending['second_var'],
-                "chosen_text": pending['right_content'],
-                "model": pending['model_provider'],
-                "category": pending['selected_category']
+        # Prompt size per option (cached = identical prefix of the previous round)
+        results = []
+        for target, name, msgs in options:
+            key = f"{target}|{name}"
+            results.append({
+                "target": target,
+                "variant": name,
+                "content": (reuse_cached and shared_cache.get_completion(target, msgs)) or "",
+                "latency": None,
+                "error": None,
+                "prompt_tokens": count_message_tokens(msgs),
+                "cached_tokens": cached_prefix_tokens(
+                    msgs, st.session_state.last_prompts.get(key), split_target(target)[0]
+                ),
             })
+            st.session_state.last_prompts[key] = msgs
+
+        with span("generate", mode=mode):
+            if mode == "Single model":
+                for result, (target, _, msgs) in zip(results, options):
+                    if result["content"]:
+                        continue
+                    try:
+                        if hedge_target:
+                            result["target"], result["content"], result["latency"] = hedged_invoke(
+                                llms, target, hedge_target, msgs, tracker
+                            )
+                        else:
+                            result["content"], result["latency"] = invoke_llm(llms[target], msgs)
+                            tracker.record_latency(target, result["latency"])
+                    except Exception as e:
+                        result["error"] = str(e)
+                        st.error(f"Error generating response:\n{e}")
+            else:
+                # Show replies as soon as each model answers
+                live = st.empty()
+                with live.container():
+                    placeholders = [col.empty() for col in st.columns(len(options))]
+                    for result, placeholder in zip(results, placeholders):
+                        placeholder.markdown(result["content"] or f"**{result['target']}** is thinking…")
+                    # Only options without a cached reply are sent
+                    todo = [i for i, result in enumerate(results) if not result["content"]]
+                    jobs = [(options[i][0], options[i][2]) for i in todo]
+                    for job_idx, text, latency, error in fan_out(llms, jobs, tracker):
+                        idx = todo[job_idx]
+                        if error is not None:
+                            results[idx]["error"] = str(error)
+                            st.error(f"Error generating response from {results[idx]['target']}:\n{error}")
+                            continue
+                        results[idx]["content"], results[idx]["latency"] = text, latency
+                        placeholders[idx].markdown(f"**{results[idx]['target']}** ({latency:.1f}s)\n\n{text}")
+                live.empty()
+
+        # Keyed on the model that answered: with hedging it can be the backup
+        for result, (_, _, msgs) in zip(results, options):
+            if result["content"] and result["latency"] is not None:
+                shared_cache.set_completion(result["target"], msgs, result["content"])
+
+        st.session_state.pending_selection = {
+            "user_input": user_input,
+            "mode": mode,
+            "options": results,
+            "selected_category": selected_category
+        }
+
+    # Show the response options side by side
+    if st.session_state.pending_selection:
+        pending = st.session_state.pending_selection
+        with span("render_options"):
+            columns = st.columns(len(pending['options']))
+
+            # Failed options can't be picked and don't count as lost rounds
+            answered = [option for option in pending['options'] if not option['error']]
+            for idx, (col, option) in enumerate(zip(columns, pending['options'])):
+                with col:
+                    st.markdown(
+                        f"**Reply (Model: {option['target']}, Category: {pending['selected_category']}, "
+                        f"Variant: {option['variant']}):**"
+                    )
+                    if option['error']:
+                        st.error(f"No reply: {option['error']}")
+                        continue
+                    latency = f"{option['latency']:.1f}s" if option['latency'] is not None else "cached"
+                    st.caption(
+                        f"Latency: {latency} · Prompt: {option['prompt_tokens']} tokens "
+                        f"(~{option['cached_tokens']} cacheable)"
+                    )
+                    st.markdown(option['content'])
+                    if st.button("Select This Reply", key=f"pick_{idx}_{len(st.session_state.messages)}"):
+                        st.session_state.messages.append({"role": "assistant", "content": option['content']})
+                        st.session_state.preferences.append({
+                            "question": pending['user_input'],
+                            "chosen_variant": option['variant'],
+                            "chosen_text": option['content'],
+                            "model": option['target'],
+                            "category": pending['selected_category']
+                        })
+                        shared_cache.increment_preference(
+                            pending['selected_category'], option['variant'], option['target']
+                        )
+                        if len(answered) > 1:
+                            winner = next(i for i, o in enumerate(answered) if o is option)
+                            record_comparison(pending['selected_category'], answered, winner)
+                            if pending['mode'] != "Single model":
+                                tracker.record_round([o['target'] for o in answered], option['target'])
+                        st.session_state.pending_selection = None
+                        st.rerun()
+
+    # Model comparison sidebar
+    # Pick up rounds and latencies recorded by other sessions and replicas
+    tracker.reload()
+    if tracker.has_rounds():
+        with st.sidebar:
+            st.header("Model Comparison")
+            st.dataframe(tracker.summary(), hide_index=True)
+
+    # Preferences sidebar
+    if st.session_state.preferences:
+        with st.sidebar:
+            st.header("Your Preferences")
+            st.write(f"Total selections: {len(st.session_state.preferences)}")
+            all_users = shared_cache.preference_counts(selected_category)
+            st.write(f"Selections in {selected_category} (all users): {sum(row['count'] for row in all_users)}")
+
+            if not st.session_state.show_preference_history:
+                if st.button("Show Preference History"):
+                    st.session_state.show_preference_history = True
+                    st.rerun()
+            else:
+                if st.button("Hide Preference History"):
+                    st.session_state.show_preference_history = False
+                    st.rerun()
+
+                st.subheader("Preference History")
+                for i, pref in enumerate(st.session_state.preferences, 1):
+                    st.text(f"{i}. Q: {pref['question'][:50]}…")
+                    st.text(f"   Chose: {pref['chosen_variant']}")
+                    st.text(f"   Model: {pref['model']}")
+                    st.text(f"   Category: {pref['category']}")
+                    st.text(f"   Reply (first 60 chars): {pref['chosen_text'][:60]}…")
+                    st.text("---")
+
+            if st.button("Clear All Preferences"):
+                st.session_state.preferences = []
+                st.session_state.show_preference_history = False
+                st.success("Preferences cleared!")
+
+    # Reset chat button
+    with st.sidebar:
+        if st.button("Reset Chat"):
+            st.session_state.messages = []
             st.session_state.pending_selection = None
+            st.session_state.last_prompts = {}
             st.rerun()
 
-# Preferences sidebar
-if st.session_state.preferences:
-    with st.sidebar:
-        st.header("Your Preferences")
-        st.write(f"Total selections: {len(st.session_state.preferences)}")
 
-        if not st.session_state.show_preference_history:
-            if st.button("Show Preference History"):
-                st.session_state.show_preference_history = True
-                st.rerun()
-        else:
-            if st.button("Hide Preference History"):
-                st.session_state.show_preference_history = False
-                st.rerun()
-
-            st.subheader("Preference History")
-            for i, pref in enumerate(st.session_state.preferences, 1):
-                st.text(f"{i}. Q: {pref['question'][:50]}…")
-                st.text(f"   Chose: {pref['chosen_variant']}")
-                st.text(f"   Model: {pref['model']}")
-                st.text(f"   Category: {pref['category']}")
-                st.text(f"   Reply (first 60 chars): {pref['chosen_text'][:60]}…")
-                st.text("---")
-
-        if st.button("Clear All Preferences"):
-            st.session_state.preferences = []
-            st.session_state.show_preference_history = False
-            st.success("Preferences cleared!")
-
-# Reset chat button
-with st.sidebar:
-    if st.button("Reset Chat"):
-        st.session_state.messages = []
-        st.session_state.pending_selection = None
-        st.rerun()
+# Opt-in profiling (PROFILE_TRACE_DIR): one trace per rerun, also finished
+# when st.rerun()/st.stop() end the script early
+with profile_request("web_app.rerun"):
+    main()